@@ -0,0 +1,305 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app
+from sqlalchemy import Integer, case, cast, func, select
+from werkzeug.local import LocalProxy
+
+from database import db
+from exam_timing import UNMEASURED, unpack_timings
+from model import ExamTiming, Question, TestResult
+from shared_cache import shared_cache
+
+# 解答時間の分布を数えるビンの上端（秒）。最後のビンはそれ以上すべて
+LATENCY_BUCKETS = (1, 2, 3, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+_LATENCY_BUCKETS_DS = tuple(b * 10 for b in LATENCY_BUCKETS)
+
+# ユーザーの章別正解率のキャッシュ期間（キーが変わらなくてもこの秒数で捨てる）
+USER_ACCURACY_CACHE_TTL = 300
+
+
+def category_sort_key(category):
+    # 数字の章を数値順に先に並べ、それ以外は名前順
+    category = category or ""
+    return (0, int(category), "") if category.isdigit() else (1, 0, category)
+
+
+def _rate(correct, answered):
+    return round(correct / answered, 4) if answered else None
+
+
+def histogram_percentile(histogram, pct):
+    """ビンごとの件数から pct 分位の秒数を求める（ビン内は線形補間、最後のビンは下端を返す）"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target = total * pct / 100
+    cumulative = 0
+    for i, count in enumerate(histogram):
+        if count and cumulative + count >= target:
+            lower = LATENCY_BUCKETS[i - 1] if i else 0
+            if i == len(LATENCY_BUCKETS):
+                return float(lower)
+            return round(lower + (LATENCY_BUCKETS[i] - lower) * (target - cumulative) / count, 1)
+        cumulative += count
+    return float(LATENCY_BUCKETS[-1])
+
+
+def user_category_accuracy(user_id):
+    """
+    ユーザーの章別正解率。共有キャッシュに置き、キーには "questions" のバージョンと
+    ユーザーの最新の解答日時を含める（解答の追加・問題の更新や削除でキーが変わる）。
+    最新の解答日時は (user_id, timestamp) インデックスの末尾を1件読むだけで引ける。
+    """
+    last_answered = db.session.query(func.max(TestResult.timestamp)).filter(TestResult.user_id == user_id).scalar()
+    key = shared_cache.versioned_key("questions", f"user_category_accuracy:{user_id}:{last_answered}")
+    stats = shared_cache.backend.get(key)
+    if stats is None:
+        stats = _query_user_category_accuracy(user_id)
+        shared_cache.backend.set(key, stats, ttl=USER_ACCURACY_CACHE_TTL)
+    return stats
+
+
+def _query_user_category_accuracy(user_id):
+    """ユーザーの章別正解率を SQL の集計だけで求める"""
+    correct = func.sum(case((TestResult.user_answer_is_correct, 1), else_=0))
+    rows = db.session.query(
+        Question.category, func.count(TestResult.id), correct
+    ).join(Question, TestResult.question_id == Question.id).filter(
+        TestResult.user_id == user_id
+    ).group_by(Question.category).all()
+
+    stats = [
+        {"category": category, "answered": answered, "correct": correct_count or 0,
+         "accuracy": _rate(correct_count or 0, answered)}
+        for category, answered, correct_count in rows
+    ]
+    return sorted(stats, key=lambda s: category_sort_key(s["category"]))
+
+
+class QuestionAnalytics:
+    """
+    問題ごとの難易度（全体の正解率）と識別力、時間制限ありの試験での解答時間の分布をキャッシュする。
+    難易度と解答時間の集計は test_results.id / exam_timings.id の最終位置から差分だけを足し込み、
+    識別力（上位群と下位群の正解率の差）と全件の再集計は一定間隔で行う。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counts = {}          # question_id -> [answered, correct]
+        self._category_counts = {}  # category -> [answered, correct]
+        self._discrimination = {}  # question_id -> (upper_rate, lower_rate)
+        self._latency = {}         # question_id -> LATENCY_BUCKETS のビンごとの件数
+        self._last_id = 0
+        self._last_timing_id = 0
+        self._last_full = 0.0
+        self._last_checked = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ANALYTICS_REFRESH_INTERVAL_SECONDS", 60)      # 差分集計の最短間隔
+        app.config.setdefault("ANALYTICS_FULL_REFRESH_SECONDS", 3600)        # 全件再集計・識別力の更新間隔
+        app.config.setdefault("ANALYTICS_MIN_ANSWERS_PER_USER", 10)          # 識別力の群分けに使うユーザーの最低解答数
+        app.config.setdefault("ANALYTICS_MIN_RESPONSES", 5)                  # 一覧に出す問題の最低解答数
+        app.config.setdefault("ANALYTICS_RUSHED_SECONDS", 3)                 # これ以下の解答時間を「速答」とみなす（ビンの上端）
+        app.extensions["question_analytics"] = self
+        self.app = app
+
+    # --- 更新 ---
+    def refresh(self, force_full=False):
+        config = self.app.config
+        now = time.monotonic()
+        with self._refresh_lock:
+            if force_full or not self._last_full or now - self._last_full >= config["ANALYTICS_FULL_REFRESH_SECONDS"]:
+                self._full_refresh()
+                self._last_full = self._last_checked = now
+            elif now - self._last_checked >= config["ANALYTICS_REFRESH_INTERVAL_SECONDS"]:
+                self._incremental_refresh()
+                self._last_checked = now
+
+    def _aggregate_counts(self, after_id=0):
+        correct = func.sum(case((TestResult.user_answer_is_correct, 1), else_=0))
+        rows = db.session.query(
+            TestResult.question_id, func.count(TestResult.id), correct, func.max(TestResult.id)
+        ).filter(TestResult.id > after_id).group_by(TestResult.question_id).all()
+        last_id = max((row[3] for row in rows), default=after_id)
+        return {row[0]: [row[1], row[2] or 0] for row in rows}, last_id
+
+    @staticmethod
+    def _aggregate_category_counts(after_id, up_to_id):
+        """章ごとの解答数・正解数を SQL で集計する（_aggregate_counts と同じ id の範囲）"""
+        correct = func.sum(case((TestResult.user_answer_is_correct, 1), else_=0))
+        rows = db.session.query(
+            Question.category, func.count(TestResult.id), correct
+        ).join(Question, TestResult.question_id == Question.id).filter(
+            TestResult.id > after_id, TestResult.id <= up_to_id
+        ).group_by(Question.category).all()
+        return {row[0]: [row[1], row[2] or 0] for row in rows}
+
+    @staticmethod
+    def _aggregate_latency(after_id=0, batch_size=1000):
+        """
+        exam_timings の BLOB を展開して、回答した問題の解答時間をビンごとに数える。
+        未回答（選択肢 0）と、経過時間が送られなかった・不正だった解答（UNMEASURED）は除く。
+        """
+        histograms = {}
+        last_id = after_id
+        rows = db.session.execute(
+            select(ExamTiming.id, ExamTiming.data).where(ExamTiming.id > after_id).order_by(ExamTiming.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for timing_id, data in rows:
+            for q_id, choice, elapsed_ds in unpack_timings(data):
+                if not choice or elapsed_ds == UNMEASURED:
+                    continue
+                histogram = histograms.get(q_id)
+                if histogram is None:
+                    histogram = histograms[q_id] = [0] * (len(LATENCY_BUCKETS) + 1)
+                histogram[bisect_left(_LATENCY_BUCKETS_DS, elapsed_ds)] += 1
+            last_id = timing_id
+        return histograms, last_id
+
+    def _incremental_refresh(self):
+        new_counts, last_id = self._aggregate_counts(self._last_id)
+        new_category_counts = self._aggregate_category_counts(self._last_id, last_id)
+        new_latency, last_timing_id = self._aggregate_latency(self._last_timing_id)
+        with self._lock:
+            for q_id, (answered, correct) in new_counts.items():
+                counts = self._counts.setdefault(q_id, [0, 0])
+                counts[0] += answered
+                counts[1] += correct
+            for category, (answered, correct) in new_category_counts.items():
+                counts = self._category_counts.setdefault(category, [0, 0])
+                counts[0] += answered
+                counts[1] += correct
+            self._last_id = last_id
+            for q_id, histogram in new_latency.items():
+                current = self._latency.get(q_id)
+                if current is None:
+                    self._latency[q_id] = histogram
+                else:
+                    for i, count in enumerate(histogram):
+                        current[i] += count
+            self._last_timing_id = last_timing_id
+
+    def _full_refresh(self):
+        counts, last_id = self._aggregate_counts()
+        category_counts = self._aggregate_category_counts(0, last_id)
+        latency, last_timing_id = self._aggregate_latency()
+        discrimination = self._compute_discrimination()
+        with self._lock:
+            self._counts = counts
+            self._category_counts = category_counts
+            self._last_id = last_id
+            self._latency = latency
+            self._last_timing_id = last_timing_id
+            self._discrimination = discrimination
+
+    def _compute_discrimination(self):
+        """
+        全体正解率でユーザーを4分位に分け、上位25%と下位25%の正解率を問題ごとに集計する。
+        ユーザーの順位付けはウィンドウ関数 (NTILE) で DB 側に任せる。
+        """
+        correct_int = cast(TestResult.user_answer_is_correct, Integer)
+        user_accuracy = select(
+            TestResult.user_id.label("user_id"), func.avg(correct_int).label("accuracy")
+        ).group_by(TestResult.user_id).having(
+            func.count(TestResult.id) >= self.app.config["ANALYTICS_MIN_ANSWERS_PER_USER"]
+        ).subquery()
+        ranked = select(
+            user_accuracy.c.user_id,
+            func.ntile(4).over(order_by=user_accuracy.c.accuracy).label("quartile")
+        ).subquery()
+
+        stmt = select(
+            TestResult.question_id,
+            func.avg(case((ranked.c.quartile == 4, correct_int))),
+            func.avg(case((ranked.c.quartile == 1, correct_int))),
+        ).join(ranked, ranked.c.user_id == TestResult.user_id).group_by(TestResult.question_id)
+
+        return {
+            q_id: (upper, lower)
+            for q_id, upper, lower in db.session.execute(stmt)
+            if upper is not None and lower is not None
+        }
+
+    # --- 参照 ---
+    def question_stats(self, sort="difficulty", limit=50):
+        """
+        問題ごとの解答数・正解率・識別力・解答時間（中央値・90パーセンタイル・速答率）を返す。
+        sort="difficulty" は正解率の低い順、"discrimination" は識別力の低い順、
+        "rushed" は速答率の高い順（時間制限ありで解答された問題のみ）。
+        """
+        self.refresh()
+        min_responses = self.app.config["ANALYTICS_MIN_RESPONSES"]
+        rushed_bins = bisect_left(LATENCY_BUCKETS, self.app.config["ANALYTICS_RUSHED_SECONDS"]) + 1
+        with self._lock:
+            stats = []
+            for q_id, (answered, correct) in self._counts.items():
+                if answered < min_responses:
+                    continue
+                upper_lower = self._discrimination.get(q_id)
+                histogram = self._latency.get(q_id)
+                timed = sum(histogram) if histogram else 0
+                stats.append({
+                    "question_id": q_id,
+                    "answered": answered,
+                    "correct_rate": _rate(correct, answered),
+                    "discrimination": round(upper_lower[0] - upper_lower[1], 4) if upper_lower else None,
+                    "timed_answers": timed,
+                    "median_seconds": histogram_percentile(histogram, 50) if timed else None,
+                    "p90_seconds": histogram_percentile(histogram, 90) if timed else None,
+                    "rushed_rate": _rate(sum(histogram[:rushed_bins]), timed) if timed else None,
+                })
+
+        if sort == "discrimination":
+            stats = [s for s in stats if s["discrimination"] is not None]
+            stats.sort(key=lambda s: s["discrimination"])
+        elif sort == "rushed":
+            stats = [s for s in stats if s["rushed_rate"] is not None]
+            stats.sort(key=lambda s: -s["rushed_rate"])
+        else:
+            stats.sort(key=lambda s: s["correct_rate"])
+        stats = stats[:limit]
+
+        # 表示する問題の本文・章だけを読み込む（削除済みの問題は除外）
+        rows = db.session.query(Question.id, Question.question, Question.category).filter(
+            Question.id.in_([s["question_id"] for s in stats])
+        ).all()
+        questions = {row[0]: row for row in rows}
+        result = []
+        for s in stats:
+            row = questions.get(s["question_id"])
+            if row is not None:
+                result.append(dict(s, question=row[1], category=row[2]))
+        return result
+
+    def latency_distribution(self, question_id):
+        """問題の解答時間の分布 [(ビンの上端秒 or None, 件数), ...]。時間制限ありの解答がなければ None"""
+        self.refresh()
+        with self._lock:
+            histogram = self._latency.get(question_id)
+            if histogram is None:
+                return None
+            return list(zip(LATENCY_BUCKETS + (None,), histogram))
+
+    def category_stats(self):
+        """
+        章ごとの全体正解率。差分集計のたびに新しい解答だけを章ごとに SQL で集計して足し込む。
+        集計後に章が変わった・削除された問題の分は、次の全件再集計で反映される。
+        """
+        self.refresh()
+        with self._lock:
+            stats = [
+                {"category": category, "answered": answered, "correct": correct, "accuracy": _rate(correct, answered)}
+                for category, (answered, correct) in self._category_counts.items()
+            ]
+        return sorted(stats, key=lambda s: category_sort_key(s["category"]))
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["question_analytics"]）を、処理中のアプリから引く
+question_analytics = LocalProxy(lambda: current_app.extensions["question_analytics"])
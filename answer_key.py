@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app
+from sqlalchemy import insert
+from werkzeug.local import LocalProxy
+
+from database import db
+from model import Question, TestResult
+
+# 採点に必要な最小限の情報（問題文・解説は含めない。章はランキング集計用）
+KeyEntry = namedtuple("KeyEntry", ["correct", "choices", "category"])
+
+
+class AnswerKey:
+    """
+    問題IDごとの正解番号と選択肢テキストを保持する採点用キャッシュ。
+    回答送信時は問題行を読み直さずにここだけで採点する。
+
+    各エントリは読み込んだ時点の "questions" のバージョンと有効期限を持ち、
+    どちらかが合わなくなったら読み直す。共有バックエンドのない複数プロセス構成
+    （CACHE_URL=memory:// で gunicorn --workers 2 など）でも、他プロセスでの正解の修正は
+    ANSWER_KEY_TTL_SECONDS 以内に採点へ反映される。
+    """
+
+    def __init__(self, app=None, version=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # question_id -> (KeyEntry, 内容バージョン, 有効期限)
+        self._version = lambda: 0
+        if app is not None:
+            self.init_app(app, version)
+
+    def init_app(self, app, version=None):
+        """version は現在の内容バージョンを返す関数（既定は常に 0 で、有効期限だけで読み直す）"""
+        app.config.setdefault("ANSWER_KEY_MAX_ENTRIES", 100000)
+        app.config.setdefault("ANSWER_KEY_TTL_SECONDS", 60)
+        if version is not None:
+            self._version = version
+        app.extensions["answer_key"] = self
+        self.app = app
+
+    def lookup(self, question_ids):
+        """問題ID → KeyEntry の辞書を返す。キャッシュにないものだけ必要な列を読み込む"""
+        found = {}
+        version = self._version()
+        now = time.monotonic()
+        with self._lock:
+            for q_id in question_ids:
+                item = self._entries.get(q_id)
+                if item is None:
+                    continue
+                entry, entry_version, expires_at = item
+                if entry_version != version or expires_at <= now:
+                    del self._entries[q_id]
+                    continue
+                self._entries.move_to_end(q_id)
+                found[q_id] = entry
+
+        missing = [q_id for q_id in question_ids if q_id not in found]
+        if missing:
+            rows = db.session.query(
+                Question.id, Question.correct,
+                Question.choice1, Question.choice2, Question.choice3, Question.choice4,
+                Question.category
+            ).filter(Question.id.in_(missing)).all()
+            loaded = {row[0]: KeyEntry(row[1], tuple(row[2:6]), row[6]) for row in rows}
+            found.update(loaded)
+            expires_at = now + self.app.config["ANSWER_KEY_TTL_SECONDS"]
+            with self._lock:
+                self._entries.update((q_id, (entry, version, expires_at)) for q_id, entry in loaded.items())
+                while len(self._entries) > self.app.config["ANSWER_KEY_MAX_ENTRIES"]:
+                    self._entries.popitem(last=False)
+        return found
+
+    def invalidate_question(self, question_id):
+        with self._lock:
+            self._entries.pop(question_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def parse_answer(value):
+    """フォームの回答値を選択肢番号に変換する。未回答は None、不正値は 0"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def choice_text(entry, number, default):
+    if number is not None and 1 <= number <= len(entry.choices):
+        return entry.choices[number - 1]
+    return default
+
+
+def grade_and_record(user_id, question_ids, form, key):
+    """
+    回答を採点して test_results にまとめて INSERT する（コミットは呼び出し側）。
+    戻り値は出題順の (問題ID, 回答番号, 正誤, 回答テキスト, 正解テキスト) のリスト。
+    """
+    entries = key.lookup(question_ids)
+    # 出題後に削除された問題は除外
+    graded_ids = [q_id for q_id in question_ids if q_id in entries]
+
+    answers = [parse_answer(form.get(f"choice_{q_id}")) for q_id in graded_ids]
+    correct = [entries[q_id].correct for q_id in graded_ids]
+    is_correct = [answer is not None and answer == c for answer, c in zip(answers, correct)]
+
+    if graded_ids:
+        db.session.execute(insert(TestResult), [
+            {"user_id": user_id, "question_id": q_id, "user_answer_is_correct": ok}
+            for q_id, ok in zip(graded_ids, is_correct)
+        ])
+
+    graded = []
+    for q_id, answer, ok in zip(graded_ids, answers, is_correct):
+        entry = entries[q_id]
+        user_answer_text = "未回答" if answer is None else choice_text(entry, answer, "無効な選択")
+        graded.append((q_id, answer, ok, user_answer_text, choice_text(entry, entry.correct, "正解不明")))
+    return graded
+
+
+def load_result_details(question_ids):
+    """結果画面用に問題文・解説・参照URLだけを読み込む"""
+    rows = db.session.query(
+        Question.id, Question.question, Question.explanation, Question.document_url
+    ).filter(Question.id.in_(question_ids)).all()
+    return {row[0]: row for row in rows}
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["answer_key"]）を、処理中のアプリから引く
+answer_key = LocalProxy(lambda: current_app.extensions["answer_key"])
@@ -1,25 +1,88 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from database import db
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, session, flash, jsonify
+from database import db, configure_sqlite, database_uri, init_schema
 from model import Question, User, TestResult
-import random   # ランダム出題用
-from itertools import groupby
+from exam_pool import ExamPool, exam_pool, load_exam_questions, random_permutation
+from fragment_cache import FragmentCache, fragment_cache
+from answer_key import AnswerKey, answer_key, grade_and_record, load_result_details
+from performance_data import performance_series, series_etag
+from analytics import QuestionAnalytics, question_analytics, user_category_accuracy
+from review_schedule import record_reviews, due_question_ids, ensure_seeded
+from search_index import search_question_ids
+from shared_cache import SharedCache, shared_cache
+from leaderboard import Leaderboard, leaderboard, METRICS, SCOPE_ALL
+import exam_timing
+from rate_limit import RateLimiter, rate_limited, rate_limiter
+import os
+from datetime import datetime
 
 from functools import wraps
 
-app = Flask(__name__)
-app.secret_key = "test123"  # 簡易セッション用（学習用）
-
-# --- DB 設定を追加 ---
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///quiz.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
-
-# --- 起動時にテーブルだけ作成 ---
-with app.app_context():
-    db.create_all()
+import click
+
+bp = Blueprint("main", __name__)
+
+
+# --- アプリケーションファクトリ ---
+def create_app(config=None):
+    app = Flask(__name__)
+    app.secret_key = "test123"  # 簡易セッション用（学習用）
+
+    # --- DB 設定を追加 ---
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri()
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # DB 処理を行うワーカースレッド数（WSGI サーバーのスレッド数・ASGI のスレッドプールと揃える）
+    app.config["DB_THREAD_POOL_SIZE"] = int(os.environ.get("DB_THREAD_POOL_SIZE", "16"))
+    # 複数ノード構成では共有バックエンド (sqlite:///path や redis://host:6379/0) を指定する
+    app.config["CACHE_URL"] = os.environ.get("CACHE_URL", "memory://")
+    app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "cookie")
+    # ログイン・回答送信の流量制限（"shared" で CACHE_URL のバックエンドを使い全ノードで共有する）
+    app.config["RATE_LIMIT_ENABLED"] = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+    app.config["RATE_LIMIT_STORAGE"] = os.environ.get("RATE_LIMIT_STORAGE", "memory")
+    if config:
+        app.config.update(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {"pool_size": app.config["DB_THREAD_POOL_SIZE"]})
+
+    # 拡張はアプリごとに作って app.extensions に登録する（モジュールの exam_pool などは処理中のアプリのものを指す）
+    db.init_app(app)
+    cache = SharedCache(app)
+    RateLimiter(app)
+    pool = ExamPool(app)
+    fragments = FragmentCache(app)
+    # 採点時に "questions" のバージョンを確認し、他ノードで修正された正解を即座に反映する
+    key = AnswerKey(app, version=lambda: cache.version("questions"))
+    QuestionAnalytics(app)
+    Leaderboard(app)
+
+    # 他ノードで問題が更新されたら、このノードのプロセス内キャッシュを捨てる
+    cache.subscribe("questions", pool.invalidate)
+    cache.subscribe("questions", fragments.clear)
+    cache.subscribe("questions", key.clear)
+
+    # 接続はまだ開かない（テーブル作成は init-db コマンドで明示的に行う）
+    with app.app_context():
+        configure_sqlite(db.engine)
+
+    app.register_blueprint(bp)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_leaderboard_command)
+    return app
+
+
+@click.command("init-db")
+def init_db_command():
+    """テーブルと全文検索索引を作成する"""
+    init_schema(db.engine)
+    click.echo("データベースを初期化しました。")
+
+
+@click.command("rebuild-leaderboard")
+def rebuild_leaderboard_command():
+    """集計期間内の test_results からランキングを作り直す"""
+    count = leaderboard.rebuild(db.session)
+    click.echo(f"ランキングを再集計しました（{count} 件）。")
 
 # --- ログインユーザーをコンテキストプロセッサでテンプレートに渡す ---
-@app.context_processor
+@bp.app_context_processor
 def inject_user():
     if 'user' in session:
         user = User.query.filter_by(email=session['user']).first()
@@ -32,7 +95,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if "user" not in session:
             flash('ログインが必要です', 'warning')
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -42,71 +105,164 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if session.get("user") != "admin@example.com":
             flash('管理者権限が必要です', 'danger')
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         return f(*args, **kwargs)
     return decorated_function
 
+# --- 章カテゴリ一覧（全ノード共有のキャッシュ） ---
+CATEGORY_CACHE_TTL = 300
+
+def get_section_categories():
+    # キーに "questions" のバージョンを含めるので、問題の更新後は自動的に読み直される
+    key = shared_cache.versioned_key("questions", "section_categories")
+    section_categories = shared_cache.backend.get(key)
+    if section_categories is None:
+        # "category"が数字であるものを章カテゴリとして取得
+        all_categories_tuples = db.session.query(Question.category).distinct().all()
+        all_categories = [c[0] for c in all_categories_tuples if c[0] is not None]
+
+        # isdigit()で数字のみを抽出し、数値としてソート
+        section_categories = sorted([c for c in all_categories if c.isdigit()], key=int)
+        shared_cache.backend.set(key, section_categories, ttl=CATEGORY_CACHE_TTL)
+    return section_categories
+
+# --- 問題の追加・編集・削除後のキャッシュ無効化 ---
+def invalidate_question_caches(question_id=None):
+    exam_pool.invalidate()
+    if question_id is not None:
+        fragment_cache.invalidate_question(question_id)
+        answer_key.invalidate_question(question_id)
+    # 他ノードには "questions" のバージョンを上げて知らせる
+    shared_cache.bump("questions")
+
+# --- 回答の採点と結果表示（章末テスト・模擬試験・再テスト共通） ---
+def render_exam_result(user, question_ids, display_name, timed_exam=None, mode=None):
+    # 復習スケジュールは今回の解答を記録する前に過去の履歴から作っておく（初回のみ）
+    ensure_seeded(user.id)
+    # 採点は正解キャッシュだけで行い、問題文・解説は結果表示用に後から読む
+    graded = grade_and_record(user.id, question_ids, request.form, answer_key)
+    graded_ids = [g[0] for g in graded]
+    is_correct = [g[2] for g in graded]
+    overtime = False
+    if timed_exam:
+        # 時間制限ありの試験は問題ごとの解答時間も1行にまとめて記録する
+        overtime = exam_timing.record_timings(
+            user.id, mode, timed_exam, graded_ids, [g[1] for g in graded],
+            exam_timing.parse_elapsed(request.form, graded_ids)
+        )
+    # 再テスト用の復習スケジュールとランキングも同じトランザクションで更新する
+    record_reviews(user.id, graded_ids, is_correct)
+    # ランキングのスコアも加算する（章は正解キャッシュから引く）
+    entries = answer_key.lookup(graded_ids)
+    categories = [entries[q_id].category if q_id in entries else None for q_id in graded_ids]
+    leaderboard.record(user.id, categories, is_correct)
+    db.session.commit()
+    details = load_result_details([q_id for q_id, *_ in graded])
+
+    results = []
+    correct_count = 0
+    for q_id, _, is_correct, user_answer_text, correct_answer_text in graded:
+        if is_correct:
+            correct_count += 1
+        _, question_text, explanation, document_url = details[q_id]
+        results.append({
+            "question": question_text,
+            "user_answer": user_answer_text,
+            "correct_answer": correct_answer_text,
+            "is_correct": is_correct,
+            "explanation": explanation,
+            "document_url": document_url
+        })
+
+    return render_template(
+        "result.html",
+        results=results,
+        correct_count=correct_count,
+        total_questions=len(results),
+        display_name=display_name,
+        overtime=overtime
+    )
+
 # --- 成績表示 ---
-@app.route("/performance")
+@bp.route("/performance")
 @login_required
 def performance():
     user = User.query.filter_by(email=session['user']).first()
     if not user:
         flash('ユーザーが見つかりません', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    # ユーザーの全テスト結果を日付順に取得
-    all_results = TestResult.query.filter_by(user_id=user.id).order_by(TestResult.timestamp).all()
-
-    # グラフ用のデータを準備
-    dates = []
-    cumulative_questions = []
-    accuracy_rates = []
-    
-    total_answered = 0
-    total_correct = 0
-
-    # 日付ごとの結果を累積して計算
-    # 同じ日付のものはまとめる
-    daily_results = {}
-    for result in all_results:
-        date_str = result.timestamp.strftime('%Y-%m-%d')
-        if date_str not in daily_results:
-            daily_results[date_str] = {'answered': 0, 'correct': 0}
-        daily_results[date_str]['answered'] += 1
-        if result.user_answer_is_correct:
-            daily_results[date_str]['correct'] += 1
-
-    # 日付でソート
-    sorted_daily_results = sorted(daily_results.items())
-
-    for date_str, data in sorted_daily_results:
-        total_answered += data['answered']
-        total_correct += data['correct']
-
-        dates.append(date_str)
-        cumulative_questions.append(total_answered)
-        
-        # 累積正解率を計算（分母が0にならないようにチェック）
-        if total_answered > 0:
-            accuracy_rates.append(round((total_correct / total_answered) * 100, 2))
-        else:
-            accuracy_rates.append(0) # もし回答がなければ0%
+    # グラフのデータは /api/performance から差分取得する
+    return render_template("performance.html", category_stats=user_category_accuracy(user.id))
 
+# --- ランキング ---
+@bp.route("/leaderboard")
+@login_required
+def leaderboard_view():
+    user = User.query.filter_by(email=session["user"]).first()
+    if not user:
+        flash('ユーザーが見つかりません', 'danger')
+        return redirect(url_for('main.login'))
+    section_categories = get_section_categories()
+    scope = request.args.get("scope", SCOPE_ALL)
+    if scope != SCOPE_ALL and scope not in section_categories:
+        scope = SCOPE_ALL
+    metric = request.args.get("metric", "accuracy")
+    if metric not in METRICS:
+        metric = "accuracy"
+
+    leaderboard.roll_window()
     return render_template(
-        "performance.html",
-        dates=dates,
-        cumulative_questions=cumulative_questions,
-        accuracy_rates=accuracy_rates
+        "leaderboard.html",
+        scope=scope,
+        metric=metric,
+        section_categories=section_categories,
+        entries=leaderboard.top(scope, metric),
+        my_rank=leaderboard.rank(user.id, scope, metric),
+        window_days=current_app.config["LEADERBOARD_WINDOW_DAYS"],
+        min_answers=leaderboard.min_answers(metric),
     )
 
+# --- 成績データ (JSON) ---
+@bp.route("/api/performance")
+@login_required
+def performance_api():
+    user = User.query.filter_by(email=session['user']).first()
+    if not user:
+        return jsonify(error="ユーザーが見つかりません"), 404
+
+    # since=YYYY-MM-DD 以降の日だけを返す（差分取得用）
+    since = request.args.get("since") or None
+    if since:
+        try:
+            since = datetime.strptime(since, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            return jsonify(error="since は YYYY-MM-DD 形式で指定してください"), 400
+
+    questions_version = shared_cache.version("questions")
+    etag = series_etag(user.id, since, questions_version)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(performance_series(user.id, since, questions_version))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 
 # --- ログイン関連 ---
-@app.route("/")
+@bp.route("/")
 def login():
     return render_template("login.html")
 
-@app.route("/try_login", methods=["POST"])
+# アカウント単位の制限のキー。IP も含めるので、他人がそのアカウントのログインを締め出すことはできない
+def login_rate_key():
+    email = (request.form.get("email") or "").strip().lower()
+    return f"{email}|{request.remote_addr}" if email else None
+
+@bp.route("/try_login", methods=["POST"])
+# パスワード検証は重いので、アカウント単位・IP 単位で試行回数と同時実行数を制限する
+@rate_limited("login", user_key=login_rate_key)
 def try_login():
     email = request.form.get("email")
     pw = request.form.get("password")
@@ -116,18 +272,18 @@ def try_login():
     if user and user.check_password(pw):
         session["user"] = user.email
         if not user.password_changed:
-            return redirect(url_for("change_password"))
-        return redirect(url_for("home"))
+            return redirect(url_for("main.change_password"))
+        return redirect(url_for("main.home"))
     else:
         return render_template("login.html", error="ログインに失敗しました")
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
     flash('ログアウトしました。', 'info')
     return redirect("/")
 
-@app.route("/change_password", methods=["GET", "POST"])
+@bp.route("/change_password", methods=["GET", "POST"])
 @login_required
 def change_password():
     if request.method == "POST":
@@ -143,23 +299,18 @@ def change_password():
             user.password_changed = True
             db.session.commit()
             flash('パスワードが変更されました。', 'success')
-            return redirect(url_for("home"))
+            return redirect(url_for("main.home"))
         else:
             # This case should not happen if login_required works
-            return redirect(url_for("login", error="ユーザーが見つかりません"))
+            return redirect(url_for("main.login", error="ユーザーが見つかりません"))
 
     return render_template("change_password.html")
 
 # --- ホーム ---
-@app.route("/home")
+@bp.route("/home")
 @login_required
 def home():
-    # "category"が数字であるものを章カテゴリとして取得
-    all_categories_tuples = db.session.query(Question.category).distinct().all()
-    all_categories = [c[0] for c in all_categories_tuples if c[0] is not None]
-    
-    # isdigit()で数字のみを抽出し、数値としてソート
-    section_categories = sorted([c for c in all_categories if c.isdigit()], key=int)
+    section_categories = get_section_categories()
 
     return render_template(
         "home.html",
@@ -168,13 +319,13 @@ def home():
     )
 
 # --- プロフィール管理 ---
-@app.route("/profile", methods=["GET", "POST"])
+@bp.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
     user = User.query.filter_by(email=session['user']).first()
     if not user:
         # Should not happen with @login_required
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     if request.method == "POST":
         nickname = request.form.get("nickname")
@@ -188,13 +339,13 @@ def profile():
         if current_password or new_password or confirm_new_password:
             if not user.check_password(current_password):
                 flash('現在のパスワードが正しくありません。', 'danger')
-                return redirect(url_for('profile'))
+                return redirect(url_for('main.profile'))
             if new_password != confirm_new_password:
                 flash('新しいパスワードが一致しません。', 'danger')
-                return redirect(url_for('profile'))
+                return redirect(url_for('main.profile'))
             if not new_password:
                 flash('新しいパスワードを入力してください。', 'danger')
-                return redirect(url_for('profile'))
+                return redirect(url_for('main.profile'))
             
             user.set_password(new_password)
             changes_made = True
@@ -212,14 +363,15 @@ def profile():
         else:
             flash('変更内容がありませんでした。', 'info')
 
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     return render_template("profile.html")
 
 
 # --- 章末テスト ---
-@app.route("/section_test/<string:section_category>", methods=["GET", "POST"])
+@bp.route("/section_test/<string:section_category>", methods=["GET", "POST"])
 @login_required
+@rate_limited("exam_submit")
 def section_test(section_category):
     display_name = f"第{section_category}章"
 
@@ -227,64 +379,15 @@ def section_test(section_category):
         user = User.query.filter_by(email=session["user"]).first()
         if not user:
             # Should not happen due to @login_required
-            return redirect(url_for("login", error="ユーザーが見つかりません"))
+            return redirect(url_for("main.login", error="ユーザーが見つかりません"))
 
         # セッションから問題IDリストを取得
         question_ids = session.get(f"section_test_{section_category}_questions", [])
         if not question_ids:
-            return redirect(url_for("home")) # セッションが切れた場合
-
-        questions = Question.query.filter(Question.id.in_(question_ids)).all()
-        # 画面表示の順序を保つためにIDをキーにした辞書を作成
-        questions_dict = {q.id: q for q in questions}
-        # セッションに保存されたIDの順序で問題リストを再構築
-        ordered_questions = [questions_dict[id] for id in question_ids if id in questions_dict]
-
-        results = []
-        correct_count = 0
-        for q in ordered_questions:
-            choice_id = f"choice_{q.id}"
-            user_answer = request.form.get(choice_id)
-            
-            if user_answer is None:
-                is_correct = False
-                user_answer_text = "未回答"
-            else:
-                user_answer = int(user_answer)
-                is_correct = (user_answer == q.correct)
-                if is_correct:
-                    correct_count += 1
-                user_answer_text = getattr(q, f"choice{user_answer}", "無効な選択")
-
-            # 結果をDBに保存
-            new_result = TestResult(
-                user_id=user.id,
-                question_id=q.id,
-                user_answer_is_correct=is_correct
-            )
-            db.session.add(new_result)
-
-            correct_answer_text = getattr(q, f"choice{q.correct}", "正解不明")
-
-            results.append({
-                "question": q.question,
-                "user_answer": user_answer_text,
-                "correct_answer": correct_answer_text,
-                "is_correct": is_correct,
-                "explanation": q.explanation,
-                "document_url": q.document_url
-            })
-        
-        db.session.commit()
-        total_questions = len(ordered_questions)
-
-        return render_template(
-            "result.html",
-            results=results,
-            correct_count=correct_count,
-            total_questions=total_questions,
-            display_name=display_name
-        )
+            return redirect(url_for("main.home")) # セッションが切れた場合
+
+        timed_exam = exam_timing.pop_timed_exam(session, f"section_test_{section_category}_timed")
+        return render_exam_result(user, question_ids, display_name, timed_exam, exam_timing.MODE_SECTION_TEST)
 
     # GET request
     num_questions_str = request.args.get("num_questions", "10")
@@ -293,103 +396,51 @@ def section_test(section_category):
     except ValueError:
         num_questions = 10
 
-    all_section_questions = Question.query.filter_by(category=section_category).all()
-    if not all_section_questions:
+    # 事前生成済みの試験インスタンス（問題ID + 選択肢の並び順）をプールから取得
+    exam = exam_pool.pop(section_category, num_questions)
+    if not exam:
         return f"{display_name}用の問題がDBにありません"
 
-    num_to_select = min(len(all_section_questions), num_questions)
-    selected_questions = random.sample(all_section_questions, num_to_select)
-
-    # 選択肢をシャッフル
-    for q in selected_questions:
-        choices = [
-            {'id': 1, 'text': q.choice1},
-            {'id': 2, 'text': q.choice2},
-            {'id': 3, 'text': q.choice3},
-            {'id': 4, 'text': q.choice4}
-        ]
-        random.shuffle(choices)
-        q.shuffled_choices = choices
+    selected_questions = load_exam_questions(exam)
 
     # 選んだ問題のIDをセッションに保存
     session[f"section_test_{section_category}_questions"] = [q.id for q in selected_questions]
 
+    # 時間制限ありなら出題時刻を保存する
+    time_limit = None
+    if request.args.get("timed") == "1":
+        exam_timing.start_timed_exam(session, f"section_test_{section_category}_timed", len(selected_questions))
+        time_limit = exam_timing.time_limit(len(selected_questions))
+    else:
+        session.pop(f"section_test_{section_category}_timed", None)
+
     return render_template(
         "section_test.html",
         questions=selected_questions,
         display_name=display_name,
-        section_category=section_category
+        section_category=section_category,
+        time_limit=time_limit
     )
 
 # --- 模擬試験 ---
-@app.route("/practice", methods=["GET", "POST"])
+@bp.route("/practice", methods=["GET", "POST"])
 @login_required
+@rate_limited("exam_submit")
 def practice():
     display_name = "模擬試験"
 
     if request.method == "POST":
         user = User.query.filter_by(email=session["user"]).first()
         if not user:
-            return redirect(url_for("login", error="ユーザーが見つかりません"))
+            return redirect(url_for("main.login", error="ユーザーが見つかりません"))
 
         # セッションから問題IDリストを取得
         question_ids = session.get("practice_questions", [])
         if not question_ids:
-            return redirect(url_for("home")) #セッションが切れた場合
+            return redirect(url_for("main.home")) #セッションが切れた場合
 
-        questions = Question.query.filter(Question.id.in_(question_ids)).all()
-        
-        # 画面表示の順序を保つためにIDをキーにした辞書を作成
-        questions_dict = {q.id: q for q in questions}
-        # セッションに保存されたIDの順序で問題リストを再構築
-        ordered_questions = [questions_dict[id] for id in question_ids if id in questions_dict]
-
-        results = []
-        correct_count = 0
-        for q in ordered_questions:
-            choice_id = f"choice_{q.id}"
-            user_answer = request.form.get(choice_id)
-            
-            if user_answer is None:
-                is_correct = False
-                user_answer_text = "未回答"
-            else:
-                user_answer = int(user_answer)
-                is_correct = (user_answer == q.correct)
-                if is_correct:
-                    correct_count += 1
-                user_answer_text = getattr(q, f"choice{user_answer}", "無効な選択")
-
-            # 結果をDBに保存
-            new_result = TestResult(
-                user_id=user.id,
-                question_id=q.id,
-                user_answer_is_correct=is_correct
-            )
-            db.session.add(new_result)
-
-            correct_answer_text = getattr(q, f"choice{q.correct}", "正解不明")
-
-            results.append({
-                "question": q.question,
-                "user_answer": user_answer_text,
-                "correct_answer": correct_answer_text,
-                "is_correct": is_correct,
-                "explanation": q.explanation,
-                "document_url": q.document_url
-            })
-        
-        db.session.commit()
-        total_questions = len(ordered_questions)
-
-        # 結果をresult.htmlに渡す
-        return render_template(
-            "result.html",
-            results=results,
-            correct_count=correct_count,
-            total_questions=total_questions,
-            display_name=display_name
-        )
+        timed_exam = exam_timing.pop_timed_exam(session, "practice_timed")
+        return render_exam_result(user, question_ids, display_name, timed_exam, exam_timing.MODE_PRACTICE)
 
     # GET request
     num_questions_str = request.args.get("num_questions", "10")
@@ -398,150 +449,67 @@ def practice():
     except ValueError:
         num_questions = 10
 
-    all_questions = Question.query.all()
-    if not all_questions:
+    # 事前生成済みの試験インスタンス（問題ID + 選択肢の並び順）をプールから取得
+    exam = exam_pool.pop(None, num_questions)
+    if not exam:
         return "問題がDBにありません"
 
-    num_to_select = min(len(all_questions), num_questions)
-    selected_questions = random.sample(all_questions, num_to_select)
-    
-    # 選択肢をシャッフル
-    for q in selected_questions:
-        choices = [
-            {'id': 1, 'text': q.choice1},
-            {'id': 2, 'text': q.choice2},
-            {'id': 3, 'text': q.choice3},
-            {'id': 4, 'text': q.choice4}
-        ]
-        random.shuffle(choices)
-        q.shuffled_choices = choices
+    selected_questions = load_exam_questions(exam)
 
     # 選んだ問題のIDをセッションに保存
     session["practice_questions"] = [q.id for q in selected_questions]
 
+    # 時間制限ありなら出題時刻を保存する
+    time_limit = None
+    if request.args.get("timed") == "1":
+        exam_timing.start_timed_exam(session, "practice_timed", len(selected_questions))
+        time_limit = exam_timing.time_limit(len(selected_questions))
+    else:
+        session.pop("practice_timed", None)
+
     return render_template(
         "practice.html",
         questions=selected_questions,
-        display_name=display_name
+        display_name=display_name,
+        time_limit=time_limit
     )
 
 
 # --- 再テスト ---
-@app.route("/retest", methods=["GET", "POST"])
+@bp.route("/retest", methods=["GET", "POST"])
 @login_required
+@rate_limited("exam_submit")
 def retest():
     user = User.query.filter_by(email=session["user"]).first()
     if not user:
-        return redirect(url_for("login", error="ユーザーが見つかりません"))
+        return redirect(url_for("main.login", error="ユーザーが見つかりません"))
 
     display_name = "苦手問題の再テスト"
 
     if request.method == "POST":
         question_ids = session.get("retest_questions", [])
         if not question_ids:
-            return redirect(url_for("home"))
-
-        questions = Question.query.filter(Question.id.in_(question_ids)).all()
-        questions_dict = {q.id: q for q in questions}
-        ordered_questions = [questions_dict[id] for id in question_ids if id in questions_dict]
+            return redirect(url_for("main.home"))
 
-        results = []
-        correct_count = 0
-        for q in ordered_questions:
-            choice_id = f"choice_{q.id}"
-            user_answer = request.form.get(choice_id)
-            
-            if user_answer is None:
-                is_correct = False
-                user_answer_text = "未回答"
-            else:
-                user_answer = int(user_answer)
-                is_correct = (user_answer == q.correct)
-                if is_correct:
-                    correct_count += 1
-                user_answer_text = getattr(q, f"choice{user_answer}", "無効な選択")
-
-            # Update existing result or create new one
-            # For simplicity, we just add a new result every time.
-            new_result = TestResult(
-                user_id=user.id,
-                question_id=q.id,
-                user_answer_is_correct=is_correct
-            )
-            db.session.add(new_result)
-
-            correct_answer_text = getattr(q, f"choice{q.correct}", "正解不明")
-
-            results.append({
-                "question": q.question,
-                "user_answer": user_answer_text,
-                "correct_answer": correct_answer_text,
-                "is_correct": is_correct,
-                "explanation": q.explanation,
-                "document_url": q.document_url
-            })
-        
-        db.session.commit()
-        total_questions = len(ordered_questions)
-
-        return render_template(
-            "result.html",
-            results=results,
-            correct_count=correct_count,
-            total_questions=total_questions,
-            display_name=display_name
-        )
+        return render_exam_result(user, question_ids, display_name)
 
-    # GET request: 苦手問題を取得
-    eligible_question_ids = []
-    
-    # ユーザーの全テスト結果を問題IDと時間でソートして取得
-    user_results = TestResult.query.filter_by(user_id=user.id).order_by(
-        TestResult.question_id, TestResult.timestamp.desc()
-    ).all()
-
-    # 問題IDごとに結果をグループ化
-    for q_id, results_group in groupby(user_results, key=lambda r: r.question_id):
-        results_list = list(results_group)
-        
-        # 直近3回の結果を取得
-        latest_three = results_list[:3]
-        
-        # 3回連続で正解しているかチェック
-        is_mastered = False
-        if len(latest_three) == 3:
-            if all(r.user_answer_is_correct for r in latest_three):
-                is_mastered = True
-        
-        # マスターしていなければ、再テスト候補に追加
-        if not is_mastered:
-            eligible_question_ids.append(q_id)
-
-    if not eligible_question_ids:
-        return render_template("retest.html", questions=[], display_name=display_name)
-    
-    # 苦手問題から出題
-    retest_questions = Question.query.filter(Question.id.in_(eligible_question_ids)).all()
-    
+    # GET request: 復習期限が来た問題を取得
     num_questions_str = request.args.get("num_questions", "10")
     try:
         num_questions = int(num_questions_str)
     except ValueError:
         num_questions = 10
 
-    num_to_select = min(len(retest_questions), num_questions)
-    selected_questions = random.sample(retest_questions, num_to_select)
-    
-    # 選択肢をシャッフル
-    for q in selected_questions:
-        choices = [
-            {'id': 1, 'text': q.choice1},
-            {'id': 2, 'text': q.choice2},
-            {'id': 3, 'text': q.choice3},
-            {'id': 4, 'text': q.choice4}
-        ]
-        random.shuffle(choices)
-        q.shuffled_choices = choices
+    # 過去の解答履歴からのスケジュール作成（ユーザーごとに一度だけ）
+    ensure_seeded(user.id)
+
+    # (user_id, due_at) インデックスの範囲検索で期限の古い順に取得
+    due_ids = due_question_ids(user.id, num_questions)
+    if not due_ids:
+        return render_template("retest.html", questions=[], display_name=display_name)
+
+    # 選択肢をシャッフル（再テストはユーザーごとに母集団が違うのでプールは使わない）
+    selected_questions = load_exam_questions([(q_id, random_permutation()) for q_id in due_ids])
 
     session["retest_questions"] = [q.id for q in selected_questions]
 
@@ -554,30 +522,41 @@ def retest():
 
 
 # --- 結果画面 ---
-@app.route("/result")
+@bp.route("/result")
 @login_required
 def result():
     ok = request.args.get("ok") == "True"
     return render_template("result.html", ok=ok)
 
 # --- 管理者画面 ---
-@app.route("/admin")
+@bp.route("/admin")
 @admin_required
 def admin_home():
-    return redirect(url_for("admin_questions"))
+    return redirect(url_for("main.admin_questions"))
+
+SEARCH_RESULT_LIMIT = 100
 
-@app.route("/admin/questions")
+@bp.route("/admin/questions")
 @admin_required
 def admin_questions():
     page = request.args.get('page', 1, type=int)
     category = request.args.get('category')
     
-    # "category"が数字であるものを章カテゴリとして取得
-    all_categories_tuples = db.session.query(Question.category).distinct().all()
-    all_categories = [c[0] for c in all_categories_tuples if c[0] is not None]
-    
-    # isdigit()で数字のみを抽出し、数値としてソート
-    section_categories = sorted([c for c in all_categories if c.isdigit()], key=int)
+    section_categories = get_section_categories()
+
+    # キーワード検索（全文検索索引で関連度順に上位を表示）
+    search_query = (request.args.get('q') or '').strip()
+    if search_query:
+        ids = search_question_ids(db.session, search_query, category=category, limit=SEARCH_RESULT_LIMIT)
+        found = {q.id: q for q in Question.query.filter(Question.id.in_(ids)).all()}
+        questions = [found[q_id] for q_id in ids if q_id in found]
+        return render_template("admin.html",
+                               questions=questions,
+                               section_categories=section_categories,
+                               selected_category=category,
+                               search_query=search_query,
+                               search_limit=SEARCH_RESULT_LIMIT,
+                               pagination=None)
 
     query = Question.query.order_by(Question.id)
     if category:
@@ -590,10 +569,11 @@ def admin_questions():
                            questions=questions, 
                            section_categories=section_categories,
                            selected_category=category,
+                           search_query=search_query,
                            pagination=pagination)
 
-@app.route("/admin/question/add", defaults={'category': ''}, methods=["GET", "POST"])
-@app.route("/admin/question/add/<string:category>", methods=["GET", "POST"])
+@bp.route("/admin/question/add", defaults={'category': ''}, methods=["GET", "POST"])
+@bp.route("/admin/question/add/<string:category>", methods=["GET", "POST"])
 @admin_required
 def add_question(category):
     if request.method == "POST":
@@ -610,12 +590,13 @@ def add_question(category):
         )
         db.session.add(new_question)
         db.session.commit()
+        invalidate_question_caches()
         original_category = request.form.get("original_category")
-        return redirect(url_for("admin_questions", category=original_category))
+        return redirect(url_for("main.admin_questions", category=original_category))
     return render_template("question_form.html", question=None, category=category)
 
-@app.route("/admin/question/edit/<int:question_id>", defaults={'category': ''}, methods=["GET", "POST"])
-@app.route("/admin/question/edit/<int:question_id>/<string:category>", methods=["GET", "POST"])
+@bp.route("/admin/question/edit/<int:question_id>", defaults={'category': ''}, methods=["GET", "POST"])
+@bp.route("/admin/question/edit/<int:question_id>/<string:category>", methods=["GET", "POST"])
 @admin_required
 def edit_question(question_id, category):
     question = Question.query.get_or_404(question_id)
@@ -630,28 +611,79 @@ def edit_question(question_id, category):
         question.explanation = request.form["explanation"]
         question.document_url = request.form["document_url"]
         db.session.commit()
+        invalidate_question_caches(question.id)
         # 元の絞り込み条件でリダイレクト
         original_category = request.form.get("original_category")
-        return redirect(url_for("admin_questions", category=original_category))
+        return redirect(url_for("main.admin_questions", category=original_category))
     # question_form.htmlにカテゴリを渡す
     return render_template("question_form.html", question=question, category=category)
 
-@app.route("/admin/question/delete/<int:question_id>", methods=["POST"])
+@bp.route("/admin/question/delete/<int:question_id>", methods=["POST"])
 @admin_required
 def delete_question(question_id):
     question = Question.query.get_or_404(question_id)
     category = request.form.get("category")
     db.session.delete(question)
     db.session.commit()
-    return redirect(url_for("admin_questions", category=category))
+    invalidate_question_caches(question_id)
+    return redirect(url_for("main.admin_questions", category=category))
+
+@bp.route("/admin/exam_pool")
+@admin_required
+def admin_exam_pool():
+    # 事前生成プールのヒット率・残数の確認用
+    return jsonify(exam_pool=exam_pool.stats(), fragment_cache=fragment_cache.stats())
+
+@bp.route("/admin/rate_limit")
+@admin_required
+def admin_rate_limit():
+    # このプロセスで受け付けた・断ったリクエスト数
+    return jsonify(rate_limiter.stats())
+
+@bp.route("/admin/analytics")
+@admin_required
+def admin_analytics():
+    sort = request.args.get("sort", "difficulty")
+    if sort not in ("difficulty", "discrimination", "rushed"):
+        sort = "difficulty"
+    return render_template(
+        "admin_analytics.html",
+        sort=sort,
+        question_stats=question_analytics.question_stats(sort=sort),
+        category_stats=question_analytics.category_stats()
+    )
+
+@bp.route("/admin/analytics/refresh", methods=["POST"])
+@admin_required
+def admin_analytics_refresh():
+    question_analytics.refresh(force_full=True)
+    return redirect(url_for("main.admin_analytics", sort=request.form.get("sort")))
+
+@bp.route("/admin/analytics/question/<int:question_id>/latency")
+@admin_required
+def admin_question_latency(question_id):
+    distribution = question_analytics.latency_distribution(question_id)
+    if distribution is None:
+        return jsonify({"question_id": question_id, "buckets": []}), 404
+    return jsonify({
+        "question_id": question_id,
+        # le_seconds が null のビンは最後のビンの上端を超えたもの
+        "buckets": [{"le_seconds": le, "count": count} for le, count in distribution],
+    })
+
+@bp.route("/admin/analytics/user/<int:user_id>")
+@admin_required
+def admin_user_analytics(user_id):
+    user = User.query.get_or_404(user_id)
+    return render_template("admin_user_analytics.html", user=user, category_stats=user_category_accuracy(user.id))
 
-@app.route("/admin/users")
+@bp.route("/admin/users")
 @admin_required
 def admin_users():
     users = User.query.filter(User.email != 'admin@example.com').order_by(User.id).all()
     return render_template("admin_users.html", users=users)
 
-@app.route("/admin/user/add", methods=["GET", "POST"])
+@bp.route("/admin/user/add", methods=["GET", "POST"])
 @admin_required
 def add_user():
     if request.method == "POST":
@@ -667,25 +699,25 @@ def add_user():
         new_user.password_changed = False # Force password change on first login
         db.session.add(new_user)
         db.session.commit()
-        return redirect(url_for("admin_users"))
+        return redirect(url_for("main.admin_users"))
     return render_template("user_form.html")
 
-@app.route("/admin/user/delete/<int:user_id>", methods=["POST"])
+@bp.route("/admin/user/delete/<int:user_id>", methods=["POST"])
 @admin_required
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     if user.email == 'admin@example.com':
         # Prevent admin from being deleted
-        return redirect(url_for("admin_users"))
+        return redirect(url_for("main.admin_users"))
     
     # Also delete related test results
     TestResult.query.filter_by(user_id=user.id).delete()
 
     db.session.delete(user)
     db.session.commit()
-    return redirect(url_for("admin_users"))
+    return redirect(url_for("main.admin_users"))
 
-@app.route("/admin/user/change_password/<int:user_id>", methods=["GET", "POST"])
+@bp.route("/admin/user/change_password/<int:user_id>", methods=["GET", "POST"])
 @admin_required
 def admin_change_password(user_id):
     user = User.query.get_or_404(user_id)
@@ -699,11 +731,15 @@ def admin_change_password(user_id):
         user.set_password(new_password)
         user.password_changed = False # Force password change on next login
         db.session.commit()
-        return redirect(url_for("admin_users"))
+        return redirect(url_for("main.admin_users"))
         
     return render_template("user_change_password.html", user=user)
 
 
 # --------------------------------------------------
 if __name__ == "__main__":
+    app = create_app()
+    # 開発サーバーでは起動時にテーブルを用意する（本番は flask --app app init-db）
+    with app.app_context():
+        init_schema(db.engine)
     app.run(debug=True)
@@ -0,0 +1,19 @@
+"""
+ASGI モードのエントリポイント
+
+    pip install a2wsgi uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+接続の受け付けはイベントループで行い、Flask のビュー（SQLite へのアクセスと
+テンプレート描画）は DB_THREAD_POOL_SIZE 本の固定スレッドプールで実行する。
+同時接続が増えてもスレッド数と DB 接続数はこの上限を超えない。
+"""
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError as e:
+    raise ImportError("ASGI モードには a2wsgi が必要です: pip install a2wsgi uvicorn") from e
+
+from app import create_app
+
+app = create_app()
+application = WSGIMiddleware(app, workers=app.config["DB_THREAD_POOL_SIZE"])
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+
+from database import database_uri, resolve_database_uri
+
+# 復元元として受け付ける最低限のテーブル
+REQUIRED_TABLES = ("users", "questions", "test_results")
+
+
+class BackupError(Exception):
+    pass
+
+
+def database_path(uri=None):
+    """アプリが使う SQLite ファイルの絶対パス"""
+    url = resolve_database_uri(uri or database_uri())
+    if not url.drivername.startswith("sqlite") or url.database in (None, "", ":memory:"):
+        raise BackupError(f"SQLite のファイルではありません: {url}")
+    return url.database
+
+
+def _connect(path, busy_timeout_ms=5000):
+    return sqlite3.connect(path, timeout=busy_timeout_ms / 1000, isolation_level=None)
+
+
+def verify_database(path, quick=False):
+    """
+    整合性チェック (integrity_check / quick_check) と必須テーブルの確認。
+    問題があれば BackupError、なければテーブルごとの行数を返す。
+    """
+    if not os.path.exists(path):
+        raise BackupError(f"ファイルがありません: {path}")
+    conn = _connect(path)
+    try:
+        check = "quick_check" if quick else "integrity_check"
+        problems = [row[0] for row in conn.execute(f"PRAGMA {check}")]
+        if problems != ["ok"]:
+            raise BackupError(f"{check} に失敗しました: " + "; ".join(problems[:5]))
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [t for t in REQUIRED_TABLES if t not in tables]
+        if missing:
+            raise BackupError("必要なテーブルがありません: " + ", ".join(missing))
+        return {t: conn.execute(f'SELECT count(*) FROM "{t}"').fetchone()[0] for t in REQUIRED_TABLES}
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"SQLite のデータベースとして読めません: {e}") from e
+    finally:
+        conn.close()
+
+
+def backup_database(source, dest, pages=256, pause=0.01, progress=None):
+    """
+    稼働中の DB を SQLite のオンラインバックアップ API で dest にコピーする。
+
+    コピー元では読み取りトランザクションを開いたままにするので、コピーは開始時点の1つのスナップショットになり、
+    途中の書き込みでバックアップがやり直しになることもない。WAL モードでは読み取りが書き込みを
+    止めないため、回答の送信はそのまま続けられる（コピー中は WAL のチェックポイントがこの時点で止まる）。
+    pages ページずつコピーし、各ステップの間に pause 秒待って I/O を譲る。
+    いったん dest + ".partial" に書き、検証してから置き換える。コピーしたバイト数を返す。
+    """
+    partial = dest + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    src = _connect(source)
+    dst = _connect(partial)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()  # ここで読み取りスナップショットを確定する
+        page_size = src.execute("PRAGMA page_size").fetchone()[0]
+
+        def on_step(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+            if remaining and pause:
+                time.sleep(pause)
+
+        src.backup(dst, pages=pages, progress=on_step)
+        total_pages = dst.execute("PRAGMA page_count").fetchone()[0]
+        src.execute("COMMIT")
+        # バックアップは単体で完結するファイルにする（-wal を伴わない）
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+    verify_database(partial, quick=True)
+    os.replace(partial, dest)
+    return total_pages * page_size
+
+
+def restore_database(backup, target, pages=1024, progress=None):
+    """
+    バックアップを検証してから target に書き戻す。
+    ファイルのコピーではなくバックアップ API で書き込むので、target の WAL と矛盾しない。
+    アプリは停止しておくこと（書き戻しの間は target への書き込みがロックで待たされる）。
+    """
+    verify_database(backup)
+    src = _connect(backup)
+    dst = _connect(target)
+    try:
+        def on_step(status, remaining, total):
+            if progress:
+                progress(total - remaining, total)
+
+        src.backup(dst, pages=pages, progress=on_step)
+    finally:
+        dst.close()
+        src.close()
+    return verify_database(target)
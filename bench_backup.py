@@ -0,0 +1,178 @@
+"""
+Backup benchmark: backup throughput and its effect on exam submissions.
+
+Seeds a throwaway SQLite database with test_results, starts a few
+simulated students that keep taking chapter tests through the Flask
+test client, and times their submit POSTs:
+
+  1. without a backup running (baseline),
+  2. while maintain_db.py's paged, throttled online backup runs,
+  3. while an unthrottled backup (all pages in one step) runs.
+
+It also reports whether the backup had to restart because of the
+concurrent writes (it should not: the source snapshot is held open).
+
+    python bench_backup.py --results 1000000 --students 4 --pages 256 --pause 0.01
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from bench_util import percentile
+
+CHOICE_RE = re.compile(r'name="choice_(\d+)"')
+
+
+def seed(path, args):
+    from database import create_cli_engine, init_schema
+    from model import User
+
+    engine = create_cli_engine("sqlite:///" + path)
+    init_schema(engine)
+    engine.dispose()
+
+    template = User()
+    template.set_password("bench")
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO questions (id, question, choice1, choice2, choice3, choice4, correct, category, explanation)"
+        " VALUES (?, ?, 'A', 'B', 'C', 'D', ?, ?, '')",
+        ((i, f"Benchmark question {i}", 1 + i % 4, str(1 + i % 10)) for i in range(1, args.questions + 1))
+    )
+    conn.executemany(
+        "INSERT INTO users (id, email, password_hash, password_changed) VALUES (?, ?, ?, 1)",
+        ((i, f"bench{i}@example.com", template.password_hash) for i in range(1, args.users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO test_results (user_id, question_id, user_answer_is_correct, timestamp)"
+        " VALUES (?, ?, ?, '2026-01-01 00:00:00')",
+        ((random.randint(1, args.users), random.randint(1, args.questions), random.random() < 0.7)
+         for _ in range(args.results))
+    )
+    conn.commit()
+    conn.close()
+
+
+class Students:
+    """別スレッドで章末テストの出題と回答送信を繰り返し、送信の所要時間を記録する"""
+
+    def __init__(self, app, count):
+        self.app = app
+        self.count = count
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = []  # (送信完了時刻, 所要ミリ秒)
+        self.errors = 0
+        self.threads = []
+
+    def start(self):
+        for i in range(self.count):
+            thread = threading.Thread(target=self.run, args=(i + 1,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, user_id):
+        client = self.app.test_client()
+        client.post("/try_login", data={"email": f"bench{user_id}@example.com", "password": "bench"})
+        while not self.stop.is_set():
+            category = random.randint(1, 10)
+            page = client.get(f"/section_test/{category}?num_questions=10").get_data(as_text=True)
+            answers = {f"choice_{q_id}": str(random.randint(1, 4)) for q_id in set(CHOICE_RE.findall(page))}
+            start = time.perf_counter()
+            response = client.post(f"/section_test/{category}", data=answers)
+            end = time.perf_counter()
+            with self.lock:
+                if response.status_code == 200:
+                    self.samples.append((end, (end - start) * 1000))
+                else:
+                    self.errors += 1
+
+    def between(self, start, end):
+        with self.lock:
+            return [ms for t, ms in self.samples if start <= t <= end]
+
+    def join(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def report(label, samples, elapsed):
+    if not samples:
+        print(f"{label:<34} no submissions")
+        return
+    print(f"{label:<34} {len(samples) / elapsed:6.1f} submits/s"
+          f"  p50 {percentile(samples, 50):7.1f} ms  p95 {percentile(samples, 95):7.1f} ms"
+          f"  max {max(samples):7.1f} ms")
+
+
+def timed_backup(source, dest, pages, pause):
+    from backup import backup_database
+
+    restarts = 0
+    last_done = 0
+
+    def progress(done, total):
+        nonlocal restarts, last_done
+        if done < last_done:
+            restarts += 1
+        last_done = done
+
+    start = time.perf_counter()
+    size = backup_database(source, dest, pages=pages, pause=pause, progress=progress)
+    return start, time.perf_counter(), size, restarts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--results", type=int, default=1000000, help="seeded test_results rows")
+    parser.add_argument("--students", type=int, default=4, help="concurrent submitting students")
+    parser.add_argument("--baseline-seconds", type=float, default=5)
+    parser.add_argument("--pages", type=int, default=256, help="pages per backup step")
+    parser.add_argument("--pause", type=float, default=0.01, help="seconds between backup steps")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="myquest-backup-bench-")
+    path = os.path.join(workdir, "bench.db")
+    os.environ["QUIZ_DATABASE_URI"] = "sqlite:///" + path
+    seed(path, args)
+
+    from app import create_app
+
+    # 同じ学生が連続で送信し続けるので、流量制限は外して測る
+    app = create_app({"RATE_LIMIT_ENABLED": False})
+    students = Students(app, args.students)
+    students.start()
+    time.sleep(1)  # ログインと出題プールの準備を待つ
+
+    start = time.perf_counter()
+    time.sleep(args.baseline_seconds)
+    baseline = (start, time.perf_counter())
+
+    throttled = timed_backup(path, os.path.join(workdir, "throttled.db"), args.pages, args.pause)
+    time.sleep(1)
+    unthrottled = timed_backup(path, os.path.join(workdir, "unthrottled.db"), -1, 0)
+    students.join()
+
+    print(f"{args.results} test_results, {args.students} students submitting 10-question tests")
+    report("no backup", students.between(*baseline), baseline[1] - baseline[0])
+    for label, (b_start, b_end, size, restarts) in (
+        (f"backup {args.pages} pages/step, {args.pause * 1000:.0f} ms pause", throttled),
+        ("backup in one step", unthrottled),
+    ):
+        elapsed = b_end - b_start
+        report(label, students.between(b_start, b_end), elapsed)
+        print(f"{'':<34} {size / 1024 / 1024:.1f} MiB in {elapsed:.2f} s"
+              f" = {size / 1024 / 1024 / elapsed:.1f} MiB/s, {restarts} restarts")
+    print(f"failed submits: {students.errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Route benchmark for the exam pages.
+
+Seeds a throwaway SQLite database, logs in a benchmark user through the
+Flask test client and times GET requests of the exam routes.
+
+    python bench_routes.py --questions 2000 --num 40 --requests 200
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bench_util import percentile
+
+
+def time_requests(client, url, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<36} mean {statistics.mean(samples):7.2f} ms"
+          f"  p50 {percentile(samples, 50):7.2f} ms"
+          f"  p95 {percentile(samples, 95):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=2000, help="number of seeded questions")
+    parser.add_argument("--num", type=int, default=40, help="questions per exam")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="myquest-bench-")
+    os.environ["QUIZ_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+
+    from app import create_app
+    from database import db, init_schema
+    from model import Question, User
+
+    app = create_app()
+    with app.app_context():
+        init_schema(db.engine)
+        for i in range(args.questions):
+            db.session.add(Question(
+                question=f"Benchmark question {i}",
+                choice1=f"choice A {i}", choice2=f"choice B {i}",
+                choice3=f"choice C {i}", choice4=f"choice D {i}",
+                correct=1 + i % 4, category=str(1 + i % 10),
+                explanation=f"explanation {i}"
+            ))
+        user = User(email="bench@example.com", password_changed=True)
+        user.set_password("bench")
+        db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    client.post("/try_login", data={"email": "bench@example.com", "password": "bench"})
+
+    scenarios = [
+        ("section_test", f"/section_test/1?num_questions={args.num}"),
+        ("practice", f"/practice?num_questions={args.num}"),
+    ]
+    print(f"{args.questions} questions, {args.num} per exam, {args.requests} requests per scenario")
+    for label, url in scenarios:
+        for cache_enabled in (False, True):
+            app.config["FRAGMENT_CACHE_ENABLED"] = cache_enabled
+            time_requests(client, url, min(20, args.requests))  # warm-up
+            samples = time_requests(client, url, args.requests)
+            report(f"{label} (fragment cache {'on' if cache_enabled else 'off'})", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""Helpers shared by the benchmark and load-test scripts."""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of samples (pct in 0-100)."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,319 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+def take_from_bucket(state, rate, burst, cost, now):
+    """
+    トークンバケットの計算。state は (残りトークン, 最終更新時刻) または None（満杯）。
+    (許可したか, 更新後のトークン, 許可されなかった場合に次に取れるまでの秒数) を返す。
+    """
+    tokens, updated_at = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rate
+
+
+class BaseCache(ABC):
+    """
+    キャッシュバックエンドの共通インターフェース。
+    値は pickle できるもの、incr() は整数カウンタ（存在しなければ 0 から）。
+    take_token() はトークンバケット（レート制限用）から原子的にトークンを取る。
+    """
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    @abstractmethod
+    def incr(self, key, delta=1):
+        pass
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in keys}
+
+    @abstractmethod
+    def take_token(self, key, rate, burst, cost=1):
+        """
+        毎秒 rate 個ずつ最大 burst 個まで溜まるバケットから cost 個取る。
+        (許可したか, 次に取れるまでの秒数) を返す。満杯に戻るまでの時間が過ぎた状態は消えてよい。
+        """
+
+    def purge_expired(self):
+        """期限切れの値を削除する（期限切れを自分で消すバックエンドでは何もしない）"""
+
+
+class MemoryCache(BaseCache):
+    """プロセス内の LRU キャッシュ（単一ノード・開発用）"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires_at)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            value, expires_at = self._data.get(key, (0, None))
+            value += delta
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            return value
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                del self._data[key]
+
+    def take_token(self, key, rate, burst, cost=1):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            state = item[0] if item is not None and item[1] > now else None
+            allowed, tokens, retry_after = take_from_bucket(state, rate, burst, cost, now)
+            self._data[key] = ((tokens, now), now + burst / rate)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return allowed, retry_after
+
+
+class SQLiteCache(BaseCache):
+    """
+    共有ファイル上の SQLite をキャッシュとして使う。
+    同じファイルを見る複数プロセス・複数ノードで値を共有できる（Redis の代わりのローカル用・テスト用）。
+    """
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _dump(value):
+        # カウンタは incr() で加算できるよう整数のまま保存する
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        return pickle.dumps(value)
+
+    @staticmethod
+    def _load(stored):
+        return stored if isinstance(stored, int) else pickle.loads(stored)
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else self._load(row[0])
+
+    def get_many(self, keys):
+        keys = list(keys)
+        result = dict.fromkeys(keys)
+        if not keys:
+            return result
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self._connect().execute(
+            f"SELECT key, value FROM cache WHERE key IN ({placeholders})"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time())
+        )
+        for key, stored in rows:
+            result[key] = self._load(stored)
+        return result
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, self._dump(value), expires_at)
+        )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key, delta=1):
+        conn = self._connect()
+        # 加算と読み出しを1つの書き込みトランザクションで行い、他プロセスと値が食い違わないようにする
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, NULL)"
+                " ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, delta)
+            )
+            value = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def take_token(self, key, rate, burst, cost=1):
+        conn = self._connect()
+        now = time.time()
+        # 読み出しと更新の間に他プロセスが割り込まないよう書き込みトランザクションで行う
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            state = None if row is None else self._load(row[0])
+            allowed, tokens, retry_after = take_from_bucket(state, rate, burst, cost, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, self._dump((tokens, now)), now + burst / rate)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def purge_expired(self):
+        self._connect().execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+# take_from_bucket() と同じ計算をサーバー側で原子的に行う
+_TOKEN_BUCKET_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisCache(BaseCache):
+    """Redis（または Redis プロトコル互換サーバー）を使う共有キャッシュ"""
+
+    def __init__(self, url, prefix="myquest:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("Redis バックエンドには redis パッケージが必要です: pip install redis") from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take_token = self.client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        stored = self.client.get(self._key(key))
+        if stored is None:
+            return None
+        try:
+            return int(stored)
+        except ValueError:
+            return pickle.loads(stored)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = self.client.mget([self._key(k) for k in keys]) if keys else []
+        result = {}
+        for key, stored in zip(keys, values):
+            if stored is None:
+                result[key] = None
+                continue
+            try:
+                result[key] = int(stored)
+            except ValueError:
+                result[key] = pickle.loads(stored)
+        return result
+
+    def set(self, key, value, ttl=None):
+        stored = value if isinstance(value, int) and not isinstance(value, bool) else pickle.dumps(value)
+        self.client.set(self._key(key), stored, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def incr(self, key, delta=1):
+        return self.client.incrby(self._key(key), delta)
+
+    def take_token(self, key, rate, burst, cost=1):
+        allowed, tokens = self._take_token(keys=[self._key(key)], args=[rate, burst, cost, time.time()])
+        if allowed:
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+
+def create_cache(url):
+    """
+    URL からバックエンドを作る。
+      memory://              プロセス内 LRU
+      sqlite:///path/to.db   共有ファイルの SQLite
+      redis://host:6379/0    Redis
+    """
+    parsed = urlparse(url or "memory://")
+    if parsed.scheme == "memory":
+        return MemoryCache()
+    if parsed.scheme == "sqlite":
+        path = url[len("sqlite:///"):]
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        return SQLiteCache(path)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisCache(url)
+    raise ValueError(f"未対応のキャッシュ URL です: {url}")
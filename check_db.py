@@ -1,23 +1,21 @@
 # check_db.py
-from app import app
-from database import db
+from database import cli_session, init_schema
 from model import Question, User
 
 def read_all_questions():
-    with app.app_context():
+    with cli_session() as session:
 
         # テーブルが無い場合はエラー防止（存在しなければ作成 ）
-        db.create_all()
+        init_schema(session.get_bind())
 
-        questions = Question.query.all()
+        # 大きな DB でも全件をメモリに載せず、少しずつ読みながら出力する
+        questions = session.query(Question).order_by(Question.id).yield_per(500)
 
         print("=== questions テーブルの内容 ===")
 
-        if not questions:
-            print("(データなし)")
-            return
-
+        count = 0
         for q in questions:
+            count += 1
             print(f"[ID] {q.id}")
             print(f"  問題   : {q.question}")
             print(f"  選択肢1: {q.choice1}")
@@ -30,28 +28,31 @@ def read_all_questions():
             print(f"  URL    : {q.document_url}")
             print("-" * 40)
 
+        if not count:
+            print("(データなし)")
+
 def create_initial_user():
-    with app.app_context():
-        db.create_all()
+    with cli_session() as session:
+        init_schema(session.get_bind())
         # Check if user already exists
-        user = User.query.filter_by(email="student@example.com").first()
+        user = session.query(User).filter_by(email="student@example.com").first()
         if not user:
             new_user = User(email="student@example.com")
             new_user.set_password("pass123")
-            db.session.add(new_user)
-            db.session.commit()
+            session.add(new_user)
+            session.commit()
             print("Initial user created.")
         else:
             print("Initial user already exists.")
         
         # Add admin user if it does not exist
-        admin = User.query.filter_by(email="admin@example.com").first()
+        admin = session.query(User).filter_by(email="admin@example.com").first()
         if not admin:
             new_admin = User(email="admin@example.com")
             new_admin.set_password("admin123")
             new_admin.password_changed = False  # Admin user must change password on first login
-            db.session.add(new_admin)
-            db.session.commit()
+            session.add(new_admin)
+            session.commit()
             print("Admin user created.")
         else:
             print("Admin user already exists.")
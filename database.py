@@ -1,3 +1,83 @@
+import os
+from contextlib import contextmanager
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+db = SQLAlchemy()
+
+DEFAULT_DATABASE_URI = "sqlite:///quiz.db"
+# Flask-SQLAlchemy は相対パスの SQLite をアプリの instance フォルダ基準で解決するので CLI もそれに合わせる
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance")
+
+
+def database_uri():
+    return os.environ.get("QUIZ_DATABASE_URI", DEFAULT_DATABASE_URI)
+
+
+def resolve_database_uri(uri):
+    url = make_url(uri)
+    if url.drivername.startswith("sqlite") and url.database not in (None, "", ":memory:") \
+            and not os.path.isabs(url.database):
+        os.makedirs(INSTANCE_PATH, exist_ok=True)
+        url = url.set(database=os.path.join(INSTANCE_PATH, url.database))
+    return url
+
+
+def configure_sqlite(engine, busy_timeout_ms=5000):
+    """
+    SQLite を WAL モードにして、読み取り中でも回答の書き込みが待たされないようにする。
+    同時書き込みはロック解除を busy_timeout まで待つ（すぐに "database is locked" にしない）。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # 新規ファイルでは空きページを maintain_db.py vacuum で少しずつ返せるようにする（既存ファイルには影響しない）。
+        # journal_mode=WAL がファイルを初期化した後では効かないので、最初に設定する
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    # 設定前に作られた接続を捨てる
+    engine.dispose()
+
+
+def init_schema(engine):
+    """テーブル・インデックス・全文検索索引を作成する（既存のものはそのまま）"""
+    import model  # noqa: F401  テーブル定義を metadata に登録する
+    from search_index import ensure_search_index
+
+    db.metadata.create_all(engine)
+    # create_all はテーブルを新規作成したときにしかインデックスを作らないので、既存のテーブルにも追加する
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    ensure_search_index(engine)
+
+
+def create_cli_engine(uri=None):
+    engine = create_engine(resolve_database_uri(uri or database_uri()))
+    configure_sqlite(engine)
+    return engine
+
 
-db = SQLAlchemy()
\ No newline at end of file
+@contextmanager
+def cli_session(uri=None):
+    """
+    Flask アプリを作らずに DB だけを使うためのセッション（CLI スクリプト用）。
+    モデルは Question.query ではなく session.query(Question) で扱う。
+    """
+    engine = create_cli_engine(uri)
+    session = Session(engine)
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from database import db
+from model import Question
+
+CHOICE_IDS = (1, 2, 3, 4)
+
+
+def random_permutation():
+    """選択肢の並び順 (1〜4 の順列) をランダムに作る"""
+    perm = list(CHOICE_IDS)
+    random.shuffle(perm)
+    return tuple(perm)
+
+
+def attach_shuffled_choices(q, perm):
+    """テンプレートが参照する q.shuffled_choices を順列どおりに組み立てる"""
+    q.shuffled_choices = [{'id': i, 'text': getattr(q, f"choice{i}")} for i in perm]
+
+
+def build_exam(question_ids, size):
+    """問題IDの母集団から (問題ID, 選択肢順列) のリストを作る"""
+    num_to_select = max(0, min(len(question_ids), size))
+    return [(q_id, random_permutation()) for q_id in random.sample(question_ids, num_to_select)]
+
+
+def load_exam_questions(exam):
+    """試験インスタンスの問題を1回のクエリで読み込み、出題順と選択肢順を復元する"""
+    question_ids = [q_id for q_id, _ in exam]
+    questions = Question.query.filter(Question.id.in_(question_ids)).all()
+    questions_dict = {q.id: q for q in questions}
+
+    ordered_questions = []
+    for q_id, perm in exam:
+        q = questions_dict.get(q_id)
+        if q is None:
+            continue  # 生成後に削除された問題
+        attach_shuffled_choices(q, perm)
+        ordered_questions.append(q)
+    return ordered_questions
+
+
+class ExamPool:
+    """
+    事前生成した試験インスタンス (問題ID + 選択肢順列) をカテゴリ・問題数ごとに保持する。
+    GET リクエストはプールから取り出すだけで済み、減った分はバックグラウンドで補充する。
+    category=None は全問題 (模擬試験) を表す。
+    カテゴリごとの問題IDの一覧は EXAM_POOL_QUESTION_IDS_TTL_SECONDS ごとに読み直す。
+    import_questions.py など管理画面以外で追加された問題も、この秒数以内に出題対象になる。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pools = {}          # (category, size) -> deque of exam
+        self._question_ids = {}   # category -> ([question_id, ...], 有効期限)
+        self._pending = set()     # 補充待ちのキー
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "refills": 0, "invalidations": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EXAM_POOL_ENABLED", True)
+        app.config.setdefault("EXAM_POOL_SIZE", 50)              # キーごとの最大保持数
+        app.config.setdefault("EXAM_POOL_REFILL_THRESHOLD", 10)  # 残りがこれ以下になったら補充
+        app.config.setdefault("EXAM_POOL_QUESTION_COUNTS", (5, 10, 20, 40))  # プール対象の問題数
+        app.config.setdefault("EXAM_POOL_QUESTION_IDS_TTL_SECONDS", 60)
+        app.extensions["exam_pool"] = self
+        self.app = app
+
+    # --- 取り出し ---
+    def pop(self, category, size):
+        """
+        試験インスタンスを1つ返す。プールが空ならその場で生成する (ミス)。
+        問題が1問もなければ空リストを返す。
+        """
+        key = (category, size)
+        config = self.app.config
+        pooled = config["EXAM_POOL_ENABLED"] and size in config["EXAM_POOL_QUESTION_COUNTS"]
+        # 問題IDの一覧が期限切れなら読み直す（母集団が変わっていればこのカテゴリのプールは捨てられる）
+        question_ids = self._get_question_ids(category)
+
+        with self._lock:
+            pool = self._pools.get(key)
+            exam = pool.popleft() if pool else None
+            if exam is not None:
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+            remaining = len(pool) if pool else 0
+
+        if exam is None:
+            exam = build_exam(question_ids, size)
+        if pooled and question_ids and remaining <= config["EXAM_POOL_REFILL_THRESHOLD"]:
+            self._schedule_refill(key)
+        return exam
+
+    def invalidate(self):
+        """問題の追加・編集・削除時に呼ぶ。生成済みインスタンスと問題IDキャッシュを破棄する"""
+        with self._lock:
+            self._pools.clear()
+            self._question_ids.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["pools"] = {
+                f"{category or 'all'}:{size}": len(pool)
+                for (category, size), pool in self._pools.items()
+            }
+        return stats
+
+    # --- 補充 ---
+    def _get_question_ids(self, category):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._question_ids.get(category)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        query = db.session.query(Question.id)
+        if category is not None:
+            query = query.filter(Question.category == category)
+        ids = [row[0] for row in query.all()]
+        with self._lock:
+            if not ids:
+                # 存在しないカテゴリ（URL は任意の文字列を受け付ける）はキャッシュに残さない
+                self._question_ids.pop(category, None)
+                return ids
+            if cached is not None and cached[0] == ids:
+                ids = cached[0]  # 母集団が同じなら生成済みのインスタンスはそのまま使う
+            else:
+                for key in [k for k in self._pools if k[0] == category]:
+                    del self._pools[key]
+            self._question_ids[category] = (ids, now + self.app.config["EXAM_POOL_QUESTION_IDS_TTL_SECONDS"])
+        return ids
+
+    def _schedule_refill(self, key):
+        with self._lock:
+            self._pending.add(key)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="exam-pool-refill", daemon=True)
+                self._worker.start()
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wakeup.wait()
+                key = self._pending.pop()
+            try:
+                with self.app.app_context():
+                    self._refill(key)
+                    db.session.remove()
+            except Exception:
+                self.app.logger.exception("exam pool refill failed for %s", key)
+
+    def _refill(self, key):
+        category, size = key
+        question_ids = self._get_question_ids(category)
+        if not question_ids:
+            return
+
+        target = self.app.config["EXAM_POOL_SIZE"]
+        with self._lock:
+            missing = target - len(self._pools.get(key, ()))
+        if missing <= 0:
+            return
+
+        exams = [build_exam(question_ids, size) for _ in range(missing)]
+        with self._lock:
+            # 生成中に invalidate された場合は古い母集団から作ったものを捨てる
+            cached = self._question_ids.get(category)
+            if cached is None or cached[0] is not question_ids:
+                return
+            pool = self._pools.setdefault(key, deque())
+            pool.extend(exams[:max(0, target - len(pool))])
+            self._stats["generated"] += len(exams)
+            self._stats["refills"] += 1
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["exam_pool"]）を、処理中のアプリから引く
+exam_pool = LocalProxy(lambda: current_app.extensions["exam_pool"])
@@ -0,0 +1,87 @@
+import struct
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from database import db
+from model import ExamTiming
+
+# 1問あたり 7 バイト: 問題ID (uint32), 選んだ選択肢 (uint8, 未回答・無効値は 0),
+# 経過時間 (uint16, 0.1秒単位。0 は計測値なしで、計測した値は最小でも 1 として保存する)
+RECORD = struct.Struct("<IBH")
+MAX_ELAPSED_DS = 0xFFFF
+UNMEASURED = 0
+VALID_CHOICES = (1, 2, 3, 4)
+
+MODE_SECTION_TEST = 1
+MODE_PRACTICE = 2
+
+# 時間制限（1問あたり）と、通信の遅れを見込んだ猶予
+SECONDS_PER_QUESTION = 60
+GRACE_SECONDS = 10
+
+
+def time_limit(question_count):
+    return SECONDS_PER_QUESTION * question_count
+
+
+def start_timed_exam(session, key, question_count):
+    """出題時刻と制限時間をセッションに保存する（採点時に pop_timed_exam で取り出す）"""
+    session[key] = {"started_at": time.time(), "limit": time_limit(question_count)}
+
+
+def pop_timed_exam(session, key):
+    return session.pop(key, None)
+
+
+def pack_timings(question_ids, choices, elapsed_ms):
+    """elapsed_ms の None は計測値なし (UNMEASURED) として保存する"""
+    return b"".join(
+        RECORD.pack(
+            q_id, choice if choice in VALID_CHOICES else 0,
+            UNMEASURED if ms is None else min(MAX_ELAPSED_DS, max(1, round(ms / 100)))
+        )
+        for q_id, choice, ms in zip(question_ids, choices, elapsed_ms)
+    )
+
+
+def unpack_timings(data):
+    """(問題ID, 選択肢, 経過時間[0.1秒]。計測値なしは UNMEASURED) を順に返す"""
+    return RECORD.iter_unpack(data)
+
+
+def parse_elapsed(form, question_ids):
+    """ブラウザが計測した問題ごとの経過時間（ミリ秒）。送られていない・数値でなければ None"""
+    elapsed = []
+    for q_id in question_ids:
+        try:
+            elapsed.append(max(0, int(float(form[f"elapsed_{q_id}"]))))
+        except (KeyError, TypeError, ValueError, OverflowError):  # "nan" は ValueError、"inf" は OverflowError
+            elapsed.append(None)
+    return elapsed
+
+
+def record_timings(user_id, mode, timed_exam, question_ids, choices, elapsed_ms, submitted_at=None):
+    """
+    解答時間を1行にまとめて INSERT する（コミットは呼び出し側）。
+    ブラウザの計測値の合計がサーバー側の経過時間を超える場合は、比率を保って縮める。
+    制限時間（＋猶予）を過ぎた提出なら True を返す。
+    """
+    submitted = submitted_at or time.time()
+    server_elapsed_ms = max(0.0, (submitted - timed_exam["started_at"]) * 1000)
+    client_total = sum(ms for ms in elapsed_ms if ms is not None)
+    if client_total > server_elapsed_ms > 0:
+        scale = server_elapsed_ms / client_total
+        elapsed_ms = [None if ms is None else ms * scale for ms in elapsed_ms]
+
+    if question_ids:
+        db.session.execute(insert(ExamTiming), {
+            "user_id": user_id,
+            "mode": mode,
+            "started_at": datetime.utcfromtimestamp(timed_exam["started_at"]),
+            "submitted_at": datetime.utcfromtimestamp(submitted),
+            "question_count": len(question_ids),
+            "data": pack_timings(question_ids, choices, elapsed_ms),
+        })
+    return server_elapsed_ms / 1000 > timed_exam["limit"] + GRACE_SECONDS
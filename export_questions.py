@@ -1,7 +1,6 @@
 import json
 import os
-from app import app
-from database import db
+from database import cli_session
 from model import Question
 
 def export_to_json():
@@ -9,8 +8,8 @@ def export_to_json():
     Exports questions from the database to a JSON file.
     The format is compatible with import_questions.py.
     """
-    with app.app_context():
-        questions = Question.query.order_by(Question.id).all()
+    with cli_session() as session:
+        questions = session.query(Question).order_by(Question.id).all()
         
         output_data = []
         for q in questions:
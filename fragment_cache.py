@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
+
+
+class FragmentCache:
+    """
+    出題画面の選択肢ブロック (HTML) を (問題ID, 内容バージョン, 選択肢順列) 単位でキャッシュする。
+    問題が編集されたら invalidate_question() でバージョンを上げ、古い断片は参照されなくなる。
+    バージョンはプロセス内の番号なので、他プロセスで編集された問題の断片も
+    FRAGMENT_CACHE_TTL_SECONDS で期限切れにして描画し直す。
+    テンプレートからは {{ question_choices(q) }} で呼び出す。
+    """
+
+    template_name = "_question_choices.html"
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()  # (question_id, version, perm) -> (Markup, 有効期限)
+        self._versions = {}              # question_id -> version
+        self._stats = {"hits": 0, "misses": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("FRAGMENT_CACHE_ENABLED", True)
+        app.config.setdefault("FRAGMENT_CACHE_MAX_ENTRIES", 20000)
+        app.config.setdefault("FRAGMENT_CACHE_TTL_SECONDS", 300)
+        app.add_template_global(self.render_choices, "question_choices")
+        app.extensions["fragment_cache"] = self
+        self.app = app
+
+    def version(self, question_id):
+        return self._versions.get(question_id, 0)
+
+    def render_choices(self, q):
+        perm = tuple(choice['id'] for choice in q.shuffled_choices)
+        if not self.app.config["FRAGMENT_CACHE_ENABLED"]:
+            return self._render(q)
+
+        key = (q.id, self.version(q.id), perm)
+        now = time.monotonic()
+        with self._lock:
+            item = self._fragments.get(key)
+            if item is not None and item[1] > now:
+                self._fragments.move_to_end(key)
+                self._stats["hits"] += 1
+                return item[0]
+            self._stats["misses"] += 1
+
+        html = self._render(q)
+        with self._lock:
+            self._fragments[key] = (html, now + self.app.config["FRAGMENT_CACHE_TTL_SECONDS"])
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.app.config["FRAGMENT_CACHE_MAX_ENTRIES"]:
+                self._fragments.popitem(last=False)
+        return html
+
+    def invalidate_question(self, question_id):
+        with self._lock:
+            self._versions[question_id] = self._versions.get(question_id, 0) + 1
+            for key in [k for k in self._fragments if k[0] == question_id]:
+                del self._fragments[key]
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._fragments))
+
+    def _render(self, q):
+        # render_template を通すとコンテキストプロセッサ（ユーザー検索）が毎回走るので直接描画する
+        template = self.app.jinja_env.get_template(self.template_name)
+        return Markup(template.render(q=q))
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["fragment_cache"]）を、処理中のアプリから引く
+fragment_cache = LocalProxy(lambda: current_app.extensions["fragment_cache"])
@@ -2,17 +2,16 @@ import json
 from datetime import datetime, timedelta, timezone
 import random
 
-from app import app
-from database import db
+from database import cli_session, init_schema
 from model import User, Question, TestResult
 
 def generate_dummy_data():
-    with app.app_context():
+    with cli_session() as session:
         print("Initializing database and generating dummy data...")
-        db.create_all()
+        init_schema(session.get_bind())
 
         # 1. Ensure Questions exist
-        if Question.query.count() == 0:
+        if session.query(Question).count() == 0:
             print("No questions found, importing from questions.json...")
             try:
                 with open("questions.json", "r", encoding="utf-8") as f:
@@ -29,8 +28,8 @@ def generate_dummy_data():
                         explanation=item.get("explanation"),
                         document_url=item.get("document_url")
                     )
-                    db.session.add(q)
-                db.session.commit()
+                    session.add(q)
+                session.commit()
                 print(f"Imported {len(data)} questions.")
             except FileNotFoundError:
                 print("questions.json not found. Creating a few default questions.")
@@ -44,34 +43,34 @@ def generate_dummy_data():
                         correct=random.randint(1, 4),
                         category=f"chapter{random.randint(1, 3)}"
                     )
-                    db.session.add(q)
-                db.session.commit()
+                    session.add(q)
+                session.commit()
                 print(f"Created 10 default questions.")
         else:
-            print(f"{Question.query.count()} questions already exist.")
+            print(f"{session.query(Question).count()} questions already exist.")
 
-        questions = Question.query.all()
+        questions = session.query(Question).all()
         if not questions:
             print("No questions available to generate test results. Please add questions first.")
             return
 
         # 2. Create a dummy user
         dummy_email = "dummy@example.com"
-        dummy_user = User.query.filter_by(email=dummy_email).first()
+        dummy_user = session.query(User).filter_by(email=dummy_email).first()
         if not dummy_user:
             print(f"Creating dummy user: {dummy_email}")
             dummy_user = User(email=dummy_email, nickname="ダミー生徒")
             dummy_user.set_password("password")
             dummy_user.password_changed = True # No forced change for dummy
-            db.session.add(dummy_user)
-            db.session.commit()
+            session.add(dummy_user)
+            session.commit()
         else:
             print(f"Dummy user '{dummy_email}' already exists.")
 
         # 3. Generate TestResult entries
         # Clear existing test results for the dummy user to avoid duplicates if run multiple times
-        TestResult.query.filter_by(user_id=dummy_user.id).delete()
-        db.session.commit()
+        session.query(TestResult).filter_by(user_id=dummy_user.id).delete()
+        session.commit()
         print("Cleared existing test results for dummy user.")
 
         num_days = 30 # Generate data for the last 30 days
@@ -99,9 +98,9 @@ def generate_dummy_data():
                     user_answer_is_correct=is_correct,
                     timestamp=timestamp
                 )
-                db.session.add(result)
+                session.add(result)
         
-        db.session.commit()
+        session.commit()
         print("Dummy test results generated successfully!")
 
 if __name__ == "__main__":
@@ -1,14 +1,13 @@
 import json
 from model import Question
-from app import app
-from database import db 
+from database import cli_session, init_schema
 
 # JSON → DB インポート
 def import_json(json_file):
     print(f"JSON 読み込み中: {json_file}")
-    with app.app_context():
+    with cli_session() as session:
 
-        db.create_all()
+        init_schema(session.get_bind())
 
         with open(json_file, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -25,9 +24,9 @@ def import_json(json_file):
                 explanation=item.get("explanation"),
                 document_url=item.get("document_url")
             )
-            db.session.add(q)
+            session.add(q)
 
-        db.session.commit()
+        session.commit()
 
         print("インポート完了！")
 
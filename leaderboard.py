@@ -0,0 +1,265 @@
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.local import LocalProxy
+
+from database import db
+from model import DailyScore, LeaderboardScore, User
+from shared_cache import shared_cache
+
+SCOPE_ALL = "all"
+METRICS = ("accuracy", "volume")
+_CUTOFF_KEY = "leaderboard:cutoff"
+
+# 集計期間外になった日別スコアを合計から差し引き、日別スコア自体も消す
+_EXPIRE_SQL = (
+    """
+    UPDATE leaderboard_scores SET
+        answered = leaderboard_scores.answered - e.answered,
+        correct = leaderboard_scores.correct - e.correct,
+        accuracy_bp = CASE WHEN leaderboard_scores.answered - e.answered > 0
+            THEN (leaderboard_scores.correct - e.correct) * 10000 / (leaderboard_scores.answered - e.answered)
+            ELSE 0 END
+    FROM (
+        SELECT scope, user_id, SUM(answered) AS answered, SUM(correct) AS correct
+        FROM daily_scores WHERE day < :cutoff GROUP BY scope, user_id
+    ) AS e
+    WHERE leaderboard_scores.scope = e.scope AND leaderboard_scores.user_id = e.user_id
+    """,
+    "DELETE FROM leaderboard_scores WHERE answered <= 0",
+    "DELETE FROM daily_scores WHERE day < :cutoff",
+)
+
+# test_results から集計期間内の日別スコアを作り直す（全体と章別）
+_REBUILD_SQL = (
+    "DELETE FROM daily_scores",
+    "DELETE FROM leaderboard_scores",
+    """
+    INSERT INTO daily_scores (scope, user_id, day, answered, correct)
+    SELECT 'all', r.user_id, date(r.timestamp), COUNT(*), SUM(r.user_answer_is_correct = 1)
+    FROM test_results r
+    WHERE r.timestamp >= :cutoff
+    GROUP BY r.user_id, date(r.timestamp)
+    """,
+    """
+    INSERT INTO daily_scores (scope, user_id, day, answered, correct)
+    SELECT q.category, r.user_id, date(r.timestamp), COUNT(*), SUM(r.user_answer_is_correct = 1)
+    FROM test_results r JOIN questions q ON q.id = r.question_id
+    WHERE r.timestamp >= :cutoff AND q.category IS NOT NULL
+    GROUP BY q.category, r.user_id, date(r.timestamp)
+    """,
+    """
+    INSERT INTO leaderboard_scores (scope, user_id, answered, correct, accuracy_bp)
+    SELECT scope, user_id, SUM(answered), SUM(correct), SUM(correct) * 10000 / SUM(answered)
+    FROM daily_scores GROUP BY scope, user_id
+    """,
+)
+
+
+def accuracy_bp(correct, answered):
+    return correct * 10000 // answered if answered else 0
+
+
+# 順位キーの式と、それを並べ替えなしで昇順に読むためのインデックス列
+_RANK_KEY_SQL = {
+    "accuracy": ("(accuracy_bp << 32) + answered", "accuracy_bp, answered"),
+    "volume": ("answered", "answered"),
+}
+
+
+def rank_key(metric, accuracy, answered):
+    """順位比較用の整数キー（大きいほど上位）。正解率が同じなら解答数の多い方を上にする"""
+    return (accuracy << 32) + answered if metric == "accuracy" else answered
+
+
+def score_deltas(categories, is_correct):
+    """1回の採点結果を 範囲 → [解答数, 正解数] にまとめる"""
+    deltas = defaultdict(lambda: [0, 0])
+    for category, ok in zip(categories, is_correct):
+        for scope in (SCOPE_ALL, category) if category else (SCOPE_ALL,):
+            deltas[scope][0] += 1
+            deltas[scope][1] += 1 if ok else 0
+    return deltas
+
+
+class Leaderboard:
+    """
+    直近 LEADERBOARD_WINDOW_DAYS 日間の正解率・解答数ランキング（全体と章別）。
+
+    採点のたびに日別スコアと期間内合計を upsert で加算し、順位は
+    leaderboard_scores の (範囲, 正解率, 解答数) / (範囲, 解答数) インデックスで引く。
+    期間外になった日の分は、日付が変わって最初に参照されたときにまとめて差し引く。
+
+    「自分の順位」は、範囲・指標ごとの順位キーの整列済み配列を各ノードに持ち、二分探索で求める
+    （SQLite のインデックスは件数を持たないので COUNT では自分より上の人数分を走査してしまう）。
+    配列は最大 LEADERBOARD_RANK_REFRESH_SECONDS ごとに読み直す。自分のスコアは常に最新を使う。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._rank_keys = {}  # (scope, metric) -> (読み込んだ時刻, 昇順の array, user_id -> キー)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LEADERBOARD_WINDOW_DAYS", 30)          # 集計期間（今日を含む日数）
+        app.config.setdefault("LEADERBOARD_MIN_ANSWERS", 20)          # 正解率ランキングに載る期間内の最低解答数
+        app.config.setdefault("LEADERBOARD_SIZE", 20)
+        app.config.setdefault("LEADERBOARD_RANK_REFRESH_SECONDS", 30)  # 順位計算用の配列を読み直す間隔
+        app.extensions["leaderboard"] = self
+        self.app = app
+
+    def cutoff(self, today=None):
+        """集計期間の初日"""
+        today = today or datetime.utcnow().date()
+        return today - timedelta(days=self.app.config["LEADERBOARD_WINDOW_DAYS"] - 1)
+
+    def min_answers(self, metric):
+        return self.app.config["LEADERBOARD_MIN_ANSWERS"] if metric == "accuracy" else 1
+
+    # --- 更新 ---
+    def record(self, user_id, categories, is_correct, answered_at=None):
+        """採点結果をスコアに加算する（コミットは呼び出し側）"""
+        deltas = score_deltas(categories, is_correct)
+        if not deltas:
+            return
+        day = (answered_at or datetime.utcnow()).date()
+
+        daily = sqlite_insert(DailyScore)
+        daily = daily.on_conflict_do_update(
+            index_elements=["scope", "user_id", "day"],
+            set_={
+                "answered": DailyScore.answered + daily.excluded.answered,
+                "correct": DailyScore.correct + daily.excluded.correct,
+            },
+        )
+        db.session.execute(daily, [
+            {"scope": scope, "user_id": user_id, "day": day, "answered": answered, "correct": correct}
+            for scope, (answered, correct) in deltas.items()
+        ])
+
+        total = sqlite_insert(LeaderboardScore)
+        new_answered = LeaderboardScore.answered + total.excluded.answered
+        new_correct = LeaderboardScore.correct + total.excluded.correct
+        total = total.on_conflict_do_update(
+            index_elements=["scope", "user_id"],
+            set_={
+                "answered": new_answered,
+                "correct": new_correct,
+                "accuracy_bp": new_correct * 10000 // new_answered,
+            },
+        )
+        db.session.execute(total, [
+            {"scope": scope, "user_id": user_id, "answered": answered, "correct": correct,
+             "accuracy_bp": accuracy_bp(correct, answered)}
+            for scope, (answered, correct) in deltas.items()
+        ])
+
+    def roll_window(self, today=None):
+        """
+        期間外になった日別スコアを合計から差し引く。集計済みの初日を共有キャッシュに記録し、
+        どのノードでも1日1回だけ実行されるようにする（同時に走っても差し引く行がなくなるだけ）。
+        """
+        cutoff = self.cutoff(today)
+        if shared_cache.backend.get(_CUTOFF_KEY) == cutoff.isoformat():
+            return False
+        expire_window(db.session, cutoff)
+        db.session.commit()
+        shared_cache.backend.set(_CUTOFF_KEY, cutoff.isoformat())
+        return True
+
+    def rebuild(self, session, today=None):
+        """test_results から集計し直す（導入時や集計期間を変えたとき）"""
+        cutoff = self.cutoff(today)
+        for sql in _REBUILD_SQL:
+            session.execute(text(sql), {"cutoff": cutoff.isoformat()})
+        session.commit()
+        shared_cache.backend.set(_CUTOFF_KEY, cutoff.isoformat())
+        return session.query(func.count(LeaderboardScore.id)).scalar()
+
+    # --- 参照 ---
+    @staticmethod
+    def _order_by(metric):
+        if metric == "accuracy":
+            return (LeaderboardScore.accuracy_bp.desc(), LeaderboardScore.answered.desc())
+        return (LeaderboardScore.answered.desc(),)
+
+    def top(self, scope, metric, limit=None):
+        """上位 limit 人。インデックス順に読むので全件の並べ替えは行わない"""
+        limit = limit or self.app.config["LEADERBOARD_SIZE"]
+        rows = db.session.query(
+            LeaderboardScore.user_id, User.nickname,
+            LeaderboardScore.answered, LeaderboardScore.correct, LeaderboardScore.accuracy_bp
+        ).join(User, User.id == LeaderboardScore.user_id).filter(
+            LeaderboardScore.scope == scope, LeaderboardScore.answered >= self.min_answers(metric)
+        ).order_by(*self._order_by(metric)).limit(limit).all()
+
+        ranked = []
+        previous, rank = None, 0
+        for position, (user_id, nickname, answered, correct, bp) in enumerate(rows, 1):
+            key = (bp, answered) if metric == "accuracy" else answered
+            if key != previous:
+                rank, previous = position, key
+            ranked.append({
+                "rank": rank, "user_id": user_id, "nickname": nickname,
+                "answered": answered, "correct": correct, "accuracy": bp / 10000,
+            })
+        return ranked
+
+    def _sorted_keys(self, scope, metric):
+        now = time.monotonic()
+        cached = self._rank_keys.get((scope, metric))
+        if cached and now - cached[0] < self.app.config["LEADERBOARD_RANK_REFRESH_SECONDS"]:
+            return cached[1:]
+        with self._lock:
+            cached = self._rank_keys.get((scope, metric))
+            if cached and now - cached[0] < self.app.config["LEADERBOARD_RANK_REFRESH_SECONDS"]:
+                return cached[1:]
+            # 計算済みのキーをインデックスの昇順に読むので、そのまま整列済みの配列になる
+            key_sql, order_by = _RANK_KEY_SQL[metric]
+            rows = db.session.execute(text(
+                f"SELECT user_id, {key_sql} FROM leaderboard_scores"
+                f" WHERE scope = :scope AND answered >= :min_answers ORDER BY {order_by}"
+            ), {"scope": scope, "min_answers": self.min_answers(metric)}).all()
+            keys = array("q", [row[1] for row in rows])
+            user_keys = dict(rows)
+            self._rank_keys[(scope, metric)] = (now, keys, user_keys)
+            return keys, user_keys
+
+    def rank(self, user_id, scope, metric):
+        """ユーザーの順位（同点は同順位）と参加人数。ランキング対象外なら rank は None"""
+        mine = db.session.query(LeaderboardScore.accuracy_bp, LeaderboardScore.answered).filter_by(
+            scope=scope, user_id=user_id
+        ).first()
+        keys, user_keys = self._sorted_keys(scope, metric)
+        if mine is None or mine.answered < self.min_answers(metric):
+            return {"rank": None, "total": len(keys), "answered": mine.answered if mine else 0,
+                    "accuracy": mine.accuracy_bp / 10000 if mine else None}
+
+        # 他のユーザーは読み込み時点のキーと比べる。スナップショット内の自分自身（古いキー）は数えない
+        key = rank_key(metric, mine.accuracy_bp, mine.answered)
+        snapshot_key = user_keys.get(user_id)
+        ahead = len(keys) - bisect_right(keys, key)
+        if snapshot_key is not None and snapshot_key > key:
+            ahead -= 1
+        total = len(keys) if snapshot_key is not None else len(keys) + 1
+        return {"rank": ahead + 1, "total": total, "answered": mine.answered,
+                "accuracy": mine.accuracy_bp / 10000}
+
+
+def expire_window(session, cutoff):
+    params = {"cutoff": cutoff.isoformat()}
+    for sql in _EXPIRE_SQL:
+        session.execute(text(sql), params)
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["leaderboard"]）を、処理中のアプリから引く
+leaderboard = LocalProxy(lambda: current_app.extensions["leaderboard"])
@@ -0,0 +1,176 @@
+"""
+Load test: many simulated students taking exams against a running server.
+
+Each simulated student logs in once, then repeatedly opens a chapter test,
+submits random answers and loads the performance JSON, like a class at
+exam start. Only the standard library is used on the client side.
+
+1. Create the student accounts in the server's database (same
+   QUIZ_DATABASE_URI as the server, questions must already exist):
+
+       python loadtest.py seed --students 500
+
+2. Start the server in the mode under test, for example
+
+       waitress-serve --threads=16 wsgi:app
+       uvicorn asgi:application --port 8080
+
+3. Run the load:
+
+       python loadtest.py run --base-url http://127.0.0.1:8080 --students 500 --iterations 3
+
+The report lists requests/sec over the whole run and p50/p95/p99 latency
+per route. Logins are reported separately because password hashing
+dominates them. Requests refused by the server's rate limiter (HTTP 429)
+are counted as "shed", not as errors. All simulated students share one
+IP address, so to measure raw capacity rather than admission control,
+start the server with RATE_LIMIT_ENABLED=0.
+"""
+import argparse
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from http.cookiejar import CookieJar
+
+from bench_util import percentile
+
+EMAIL_PATTERN = "loadtest{}@example.com"
+PASSWORD = "loadtest"
+CHOICE_RE = re.compile(r'name="choice_(\d+)"')
+
+
+def seed(args):
+    from database import cli_session
+    from model import User
+
+    with cli_session() as session:
+        # パスワードハッシュは重いので1回だけ計算して全員に使い回す
+        template = User()
+        template.set_password(PASSWORD)
+        existing = {email for (email,) in session.query(User.email).filter(User.email.like("loadtest%"))}
+        created = 0
+        for i in range(args.students):
+            email = EMAIL_PATTERN.format(i)
+            if email in existing:
+                continue
+            session.add(User(email=email, password_hash=template.password_hash, password_changed=True))
+            created += 1
+        session.commit()
+    print(f"created {created} students ({args.students - created} already existed)")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.shed = defaultdict(int)
+
+    def record(self, route, elapsed_ms, ok, shed=False):
+        with self.lock:
+            if ok:
+                self.samples[route].append(elapsed_ms)
+            elif shed:
+                self.shed[route] += 1
+            else:
+                self.errors[route] += 1
+
+
+def timed_request(opener, recorder, route, url, data=None, timeout=120):
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    start = time.perf_counter()
+    shed = False
+    try:
+        with opener.open(url, data=body, timeout=timeout) as response:
+            text = response.read().decode("utf-8", "replace")
+            ok = response.status == 200
+    except urllib.error.HTTPError as e:
+        text, ok, shed = "", False, e.code == 429
+    except (urllib.error.URLError, OSError):
+        text, ok = "", False
+    recorder.record(route, (time.perf_counter() - start) * 1000, ok, shed)
+    return text if ok else None
+
+
+def student(index, args, recorder, start_barrier):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    base = args.base_url.rstrip("/")
+    start_barrier.wait()
+
+    login = timed_request(opener, recorder, "login", f"{base}/try_login",
+                          {"email": EMAIL_PATTERN.format(index), "password": PASSWORD}, timeout=args.timeout)
+    if login is None:
+        return
+
+    for _ in range(args.iterations):
+        category = random.choice(args.categories)
+        page = timed_request(opener, recorder, "GET section_test",
+                             f"{base}/section_test/{category}?num_questions={args.num_questions}", timeout=args.timeout)
+        if page is None:
+            continue
+        answers = {f"choice_{q_id}": str(random.randint(1, 4)) for q_id in set(CHOICE_RE.findall(page))}
+        timed_request(opener, recorder, "POST section_test", f"{base}/section_test/{category}", answers,
+                      timeout=args.timeout)
+        timed_request(opener, recorder, "GET api/performance", f"{base}/api/performance", timeout=args.timeout)
+
+
+def run(args):
+    recorder = Recorder()
+    barrier = threading.Barrier(args.students + 1)
+    threads = [
+        threading.Thread(target=student, args=(i, args, recorder, barrier), daemon=True)
+        for i in range(args.students)
+    ]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(s) for s in recorder.samples.values())
+    errors = sum(recorder.errors.values())
+    shed = sum(recorder.shed.values())
+    print(f"{args.students} students x {args.iterations} iterations in {elapsed:.1f} s")
+    print(f"{total} ok / {shed} shed (429) / {errors} failed requests, {total / elapsed:.1f} req/s overall")
+    non_login = sum(len(s) for route, s in recorder.samples.items() if route != "login")
+    print(f"{non_login / elapsed:.1f} req/s excluding logins")
+    print(f"{'route':<22}{'count':>7}{'shed':>7}{'errors':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for route in sorted(set(recorder.samples) | set(recorder.errors) | set(recorder.shed)):
+        samples = recorder.samples.get(route) or [0.0]
+        print(f"{route:<22}{len(recorder.samples.get(route, [])):>7}{recorder.shed.get(route, 0):>7}"
+              f"{recorder.errors.get(route, 0):>8}"
+              f"{statistics.mean(samples):>10.1f}{percentile(samples, 50):>10.1f}"
+              f"{percentile(samples, 95):>10.1f}{percentile(samples, 99):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="create the simulated student accounts")
+    seed_parser.add_argument("--students", type=int, default=500)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = subparsers.add_parser("run", help="run the load against a server")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--students", type=int, default=500)
+    run_parser.add_argument("--iterations", type=int, default=3, help="exams per student")
+    run_parser.add_argument("--num-questions", type=int, default=10)
+    run_parser.add_argument("--categories", nargs="+", default=["1"], help="chapters to draw tests from")
+    run_parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Maintenance commands for a long-running quiz database (SQLite).
+
+    python maintain_db.py report              table / index sizes and row counts
+    python maintain_db.py orphans [--delete]  rows whose user or question no longer exists
+    python maintain_db.py vacuum [--pages N]  return free pages to the OS in small steps
+    python maintain_db.py analyze             refresh the planner statistics
+    python maintain_db.py indexes             hot queries whose plan scans a whole table
+    python maintain_db.py backup DEST         online backup while the app keeps running
+    python maintain_db.py restore SRC --yes   verify a backup and write it back (stop the app first)
+
+The database is the same one the app uses (QUIZ_DATABASE_URI). Every
+command prints one line per table or step as soon as it is known, so
+progress is visible on large databases. report, orphans (without
+--delete) and indexes only read.
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import text
+
+from backup import BackupError, backup_database, database_path, restore_database, verify_database
+from database import create_cli_engine, db
+
+# auto_vacuum の値
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# アプリが頻繁に実行するクエリ（各モジュールのクエリと同じ形）と、索引が無いときの追加候補
+HOT_QUERIES = (
+    ("login / current user",
+     "SELECT id, password_hash FROM users WHERE email = :email",
+     None),
+    ("exam pool refill for a chapter",
+     "SELECT id FROM questions WHERE category = :category",
+     "CREATE INDEX ix_questions_category ON questions (category)"),
+    ("admin question list for a chapter",
+     "SELECT * FROM questions WHERE category = :category ORDER BY id LIMIT 20",
+     "CREATE INDEX ix_questions_category ON questions (category)"),
+    ("answer key / exam questions",
+     "SELECT id, correct, choice1, choice2, choice3, choice4, category FROM questions WHERE id IN (:id, :id2)",
+     None),
+    ("performance ETag",
+     "SELECT count(id), max(id) FROM test_results WHERE user_id = :user_id",
+     None),
+    ("performance series",
+     "SELECT date(r.timestamp) AS day, q.category, count(r.id) FROM test_results r"
+     " LEFT JOIN questions q ON r.question_id = q.id"
+     " WHERE r.user_id = :user_id AND r.timestamp >= :since GROUP BY day, q.category ORDER BY day",
+     None),
+    ("retest due questions",
+     "SELECT question_id FROM review_schedules WHERE user_id = :user_id AND due_at <= :now"
+     " ORDER BY due_at LIMIT 10",
+     None),
+    ("review schedules on submit",
+     "SELECT * FROM review_schedules WHERE user_id = :user_id AND question_id IN (:id, :id2)",
+     None),
+    ("leaderboard top",
+     "SELECT user_id, answered, correct, accuracy_bp FROM leaderboard_scores"
+     " WHERE scope = :scope AND answered >= 20 ORDER BY accuracy_bp DESC, answered DESC LIMIT 20",
+     None),
+    ("leaderboard own score",
+     "SELECT accuracy_bp, answered FROM leaderboard_scores WHERE scope = :scope AND user_id = :user_id",
+     None),
+    ("delete question: its results",
+     "SELECT id FROM test_results WHERE question_id = :question_id",
+     "CREATE INDEX ix_test_results_question_id ON test_results (question_id)"),
+    ("delete question: its review schedules",
+     "SELECT id FROM review_schedules WHERE question_id = :question_id",
+     "CREATE INDEX ix_review_schedules_question_id ON review_schedules (question_id)"),
+    ("delete user: leaderboard rows",
+     "SELECT id FROM leaderboard_scores WHERE user_id = :user_id",
+     "CREATE INDEX ix_leaderboard_scores_user_id ON leaderboard_scores (user_id)"),
+    ("delete user: daily score rows",
+     "SELECT id FROM daily_scores WHERE user_id = :user_id",
+     "CREATE INDEX ix_daily_scores_user_id ON daily_scores (user_id)"),
+)
+_DUMMY_PARAMS = {
+    "email": "", "category": "1", "id": 1, "id2": 2, "user_id": 1, "question_id": 1,
+    "since": "2000-01-01", "now": "2000-01-01", "scope": "all",
+}
+
+
+def emit(line=""):
+    print(line, flush=True)
+
+
+def human_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def pragma(connection, name):
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def database_file(connection):
+    # main データベースのファイルパス（:memory: なら空）
+    for _, name, path in connection.exec_driver_sql("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return ""
+
+
+def has_dbstat(connection):
+    try:
+        connection.exec_driver_sql("SELECT 1 FROM dbstat LIMIT 1").all()
+        return True
+    except Exception:
+        return False
+
+
+def object_size(connection, name):
+    return connection.execute(
+        text("SELECT pgsize FROM dbstat WHERE name = :name AND aggregate = TRUE"), {"name": name}
+    ).scalar() or 0
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# --- report ---
+def report(args):
+    engine = create_cli_engine()
+    with engine.connect() as connection:
+        page_size = pragma(connection, "page_size")
+        page_count = pragma(connection, "page_count")
+        freelist = pragma(connection, "freelist_count")
+        path = database_file(connection)
+        wal_size = os.path.getsize(path + "-wal") if path and os.path.exists(path + "-wal") else 0
+
+        emit(f"database   {path or '(memory)'}")
+        emit(f"size       {human_size(page_size * page_count)} ({page_count} pages of {page_size} B),"
+             f" WAL {human_size(wal_size)}")
+        emit(f"free       {human_size(page_size * freelist)} ({freelist} pages,"
+             f" {freelist / page_count * 100 if page_count else 0:.1f}%)")
+        emit(f"journal    {pragma(connection, 'journal_mode')},"
+             f" auto_vacuum {AUTO_VACUUM_MODES.get(pragma(connection, 'auto_vacuum'), '?')}")
+        emit()
+
+        sizes = has_dbstat(connection)
+        if not sizes:
+            emit("(this SQLite build has no dbstat table; sizes are not available)")
+        tables = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).scalars().all()
+        emit(f"{'table / index':<48}{'rows':>12}{'size':>12}")
+        for table in tables:
+            rows = "-"
+            if not args.no_counts:
+                try:
+                    rows = connection.exec_driver_sql(f"SELECT count(*) FROM {quote(table)}").scalar()
+                except Exception:
+                    rows = "?"  # 読めない仮想テーブル
+            size = human_size(object_size(connection, table)) if sizes else "-"
+            emit(f"{table:<48}{rows:>12}{size:>12}")
+            indexes = connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table ORDER BY name"),
+                {"table": table}
+            ).scalars().all()
+            for index in indexes:
+                size = human_size(object_size(connection, index)) if sizes else "-"
+                emit(f"  {index:<46}{'':>12}{size:>12}")
+    engine.dispose()
+
+
+# --- orphans ---
+def orphan_checks():
+    """モデルの外部キーから (子テーブル, 列, 親テーブル, 親の列) を列挙する"""
+    import model  # noqa: F401  テーブル定義を metadata に登録する
+
+    for table in db.metadata.sorted_tables:
+        for fk in table.foreign_keys:
+            yield table.name, fk.parent.name, fk.column.table.name, fk.column.name
+
+
+def orphan_condition(child, column, parent, parent_column):
+    return (
+        f"{quote(child)}.{quote(column)} IS NOT NULL AND NOT EXISTS ("
+        f"SELECT 1 FROM {quote(parent)} WHERE {quote(parent)}.{quote(parent_column)} = {quote(child)}.{quote(column)})"
+    )
+
+
+def orphans(args):
+    engine = create_cli_engine()
+    total = 0
+    # 親が消えた行を1つの NOT EXISTS で数える（行ごとの問い合わせはしない）
+    with engine.begin() as connection:
+        for child, column, parent, parent_column in orphan_checks():
+            condition = orphan_condition(child, column, parent, parent_column)
+            count = connection.exec_driver_sql(f"SELECT count(*) FROM {quote(child)} WHERE {condition}").scalar()
+            total += count
+            emit(f"{child}.{column} -> {parent}.{parent_column}: {count} orphaned")
+            if count and args.list:
+                rows = connection.execution_options(stream_results=True, yield_per=1000).exec_driver_sql(
+                    f"SELECT id, {quote(column)} FROM {quote(child)} WHERE {condition} ORDER BY id"
+                )
+                for row_id, missing in rows:
+                    emit(f"  id={row_id} {column}={missing}")
+            if count and args.delete:
+                deleted = connection.exec_driver_sql(f"DELETE FROM {quote(child)} WHERE {condition}").rowcount
+                emit(f"  deleted {deleted}")
+    engine.dispose()
+    emit(f"{total} orphaned rows" + (" deleted" if args.delete else ""))
+    if total and not args.delete:
+        emit("run with --delete to remove them")
+
+
+# --- vacuum ---
+def vacuum(args):
+    engine = create_cli_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        mode = pragma(connection, "auto_vacuum")
+        free = pragma(connection, "freelist_count")
+        if mode != 2:
+            if not args.enable_incremental:
+                emit(f"auto_vacuum is {AUTO_VACUUM_MODES.get(mode, mode)}; incremental vacuum is not available.")
+                emit("run with --enable-incremental once to switch (rebuilds the whole file with VACUUM,"
+                     " which blocks writers while it runs)")
+                return
+            emit("switching to auto_vacuum=incremental (full VACUUM) ...")
+            started = time.perf_counter()
+            connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+            emit(f"done in {time.perf_counter() - started:.1f} s")
+        else:
+            # 少しずつ解放して、その間にも回答の書き込みが入れるようにする
+            emit(f"{free} free pages")
+            started = time.perf_counter()
+            while free > 0:
+                # sqlite3 の execute() は1ステップ（1ページ）で止めるので、最後まで実行する executescript を使う
+                connection.connection.driver_connection.executescript(
+                    f"PRAGMA incremental_vacuum({min(free, args.pages)})"
+                )
+                free = pragma(connection, "freelist_count")
+                emit(f"  {free} free pages left")
+                if free and args.pause:
+                    time.sleep(args.pause)
+            emit(f"done in {time.perf_counter() - started:.1f} s")
+        # WAL に残ったページを本体に書き戻し、WAL ファイルを切り詰める
+        busy, log, checkpointed = connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()
+        emit(f"checkpoint: {checkpointed}/{log} WAL frames" + (" (busy, retry later)" if busy else ""))
+        emit(f"size now {human_size(pragma(connection, 'page_size') * pragma(connection, 'page_count'))}")
+    engine.dispose()
+
+
+# --- analyze ---
+def analyze(args):
+    engine = create_cli_engine()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if args.limit:
+            # 大きなテーブルでは各インデックスの先頭 N 行だけを見て概算する
+            connection.exec_driver_sql(f"PRAGMA analysis_limit = {int(args.limit)}")
+        tables = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            " AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' ORDER BY name"
+        ).scalars().all()
+        for table in tables:
+            started = time.perf_counter()
+            connection.exec_driver_sql(f"ANALYZE {quote(table)}")
+            emit(f"analyzed {table} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        connection.exec_driver_sql("PRAGMA optimize")
+    engine.dispose()
+
+
+# --- indexes ---
+def indexes(args):
+    engine = create_cli_engine()
+    flagged = 0
+    with engine.connect() as connection:
+        for name, sql, suggestion in HOT_QUERIES:
+            try:
+                plan = [row[3] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql), _DUMMY_PARAMS)]
+            except Exception as e:
+                emit(f"?    {name}: {e.__class__.__name__}")
+                continue
+            # "SCAN <table>" はテーブル（またはインデックス全体）を先頭から最後まで読む
+            scans = [step for step in plan if step.startswith("SCAN ")]
+            if scans:
+                flagged += 1
+                emit(f"SCAN {name}")
+                for step in scans:
+                    emit(f"       {step}")
+                if suggestion:
+                    emit(f"       suggestion: {suggestion}")
+            elif args.verbose:
+                emit(f"ok   {name}")
+                for step in plan:
+                    emit(f"       {step}")
+            else:
+                emit(f"ok   {name}")
+    engine.dispose()
+    emit(f"{flagged} of {len(HOT_QUERIES)} hot queries scan a whole table")
+    return flagged
+
+
+# --- backup / restore ---
+class ProgressPrinter:
+    """ページ単位の進捗を 10% ごとに1行出力する"""
+
+    def __init__(self, label):
+        self.label = label
+        self.next_percent = 0
+
+    def __call__(self, done, total):
+        percent = done * 100 // total if total else 100
+        if percent >= self.next_percent:
+            emit(f"  {self.label} {percent:3d}% ({done}/{total} pages)")
+            self.next_percent = percent // 10 * 10 + 10
+
+
+def backup(args):
+    source = database_path()
+    emit(f"backing up {source} -> {args.dest}")
+    started = time.perf_counter()
+    try:
+        size = backup_database(source, args.dest, pages=args.pages, pause=args.pause,
+                               progress=ProgressPrinter("copied"))
+    except BackupError as e:
+        emit(f"backup failed: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    emit(f"done: {human_size(size)} in {elapsed:.1f} s ({human_size(size / elapsed if elapsed else size)}/s),"
+         f" quick_check ok")
+
+
+def restore(args):
+    target = database_path()
+    try:
+        counts = verify_database(args.source)
+    except BackupError as e:
+        emit(f"not restoring: {e}")
+        sys.exit(1)
+    emit(f"{args.source}: integrity_check ok, " + ", ".join(f"{t} {n}" for t, n in counts.items()))
+    if os.path.exists(target) and not args.yes:
+        emit(f"{target} exists; stop the app and run again with --yes to overwrite it")
+        sys.exit(1)
+
+    emit(f"restoring into {target}")
+    try:
+        counts = restore_database(args.source, target, progress=ProgressPrinter("restored"))
+    except BackupError as e:
+        emit(f"restore failed: {e}")
+        sys.exit(1)
+    emit("done: integrity_check ok, " + ", ".join(f"{t} {n}" for t, n in counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="table / index sizes and row counts")
+    report_parser.add_argument("--no-counts", action="store_true", help="skip COUNT(*) on every table")
+    report_parser.set_defaults(func=report)
+
+    orphans_parser = subparsers.add_parser("orphans", help="find rows that reference a missing user or question")
+    orphans_parser.add_argument("--list", action="store_true", help="print the id of every orphaned row")
+    orphans_parser.add_argument("--delete", action="store_true", help="delete the orphaned rows")
+    orphans_parser.set_defaults(func=orphans)
+
+    vacuum_parser = subparsers.add_parser("vacuum", help="incremental VACUUM")
+    vacuum_parser.add_argument("--pages", type=int, default=1000, help="pages released per step")
+    vacuum_parser.add_argument("--pause", type=float, default=0.05, help="seconds to wait between steps")
+    vacuum_parser.add_argument("--enable-incremental", action="store_true",
+                               help="switch auto_vacuum to incremental (runs one full VACUUM)")
+    vacuum_parser.set_defaults(func=vacuum)
+
+    analyze_parser = subparsers.add_parser("analyze", help="ANALYZE every table")
+    analyze_parser.add_argument("--limit", type=int, default=0,
+                                help="analysis_limit: rows sampled per index (0 = all)")
+    analyze_parser.set_defaults(func=analyze)
+
+    indexes_parser = subparsers.add_parser("indexes", help="hot queries whose plan scans a whole table")
+    indexes_parser.add_argument("--verbose", action="store_true", help="print the plan of every query")
+    indexes_parser.set_defaults(func=indexes)
+
+    backup_parser = subparsers.add_parser("backup", help="online backup to a file")
+    backup_parser.add_argument("dest", help="backup file to write")
+    backup_parser.add_argument("--pages", type=int, default=256, help="pages copied per step")
+    backup_parser.add_argument("--pause", type=float, default=0.01, help="seconds to wait between steps")
+    backup_parser.set_defaults(func=backup)
+
+    restore_parser = subparsers.add_parser("restore", help="verify a backup and write it back")
+    restore_parser.add_argument("source", help="backup file to restore")
+    restore_parser.add_argument("--yes", action="store_true", help="overwrite the existing database")
+    restore_parser.set_defaults(func=restore)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    if args.command == "indexes" and result:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from database import cli_session, init_schema
+from review_schedule import seed_schedules
+
+# 既存の test_results から再テスト用の復習スケジュールを作成する
+# 何度実行しても、作成済みの (ユーザー, 問題) はそのまま残る
+def migrate():
+    with cli_session() as session:
+        # review_schedules テーブルが無ければ作成
+        init_schema(session.get_bind())
+
+        created = seed_schedules(session)
+        session.commit()
+
+        print(f"復習スケジュールを {created} 件作成しました。")
+
+if __name__ == "__main__":
+    migrate()
@@ -19,6 +19,7 @@ class Question(db.Model):
 
     # TestResult との関連付け
     results = db.relationship("TestResult", back_populates="question", cascade="all, delete-orphan")
+    review_schedules = db.relationship("ReviewSchedule", back_populates="question", cascade="all, delete-orphan")
 
 
 class User(db.Model):
@@ -32,6 +33,11 @@ class User(db.Model):
 
     # TestResult との関連付け
     results = db.relationship("TestResult", back_populates="user")
+    review_schedules = db.relationship("ReviewSchedule", back_populates="user", cascade="all, delete-orphan")
+    review_seed = db.relationship("ReviewSeed", cascade="all, delete-orphan")
+    daily_scores = db.relationship("DailyScore", cascade="all, delete-orphan")
+    leaderboard_scores = db.relationship("LeaderboardScore", cascade="all, delete-orphan")
+    exam_timings = db.relationship("ExamTiming", cascade="all, delete-orphan")
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -42,6 +48,10 @@ class User(db.Model):
 
 class TestResult(db.Model):
     __tablename__ = "test_results"
+    __table_args__ = (
+        # 成績の集計・ETag 計算はユーザー単位なので (user_id, timestamp) で引けるようにする
+        db.Index("ix_test_results_user_id_timestamp", "user_id", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -55,3 +65,86 @@ class TestResult(db.Model):
 
     def __repr__(self):
         return f"<TestResult user_id={self.user_id} q_id={self.question_id} correct={self.user_answer_is_correct}>"
+
+
+class ReviewSchedule(db.Model):
+    """再テスト用の復習スケジュール（ユーザー × 問題ごとに次回出題日時と間隔を持つ）"""
+    __tablename__ = "review_schedules"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "question_id", name="uq_review_schedules_user_question"),
+        # 「今出題すべき問題」は (user_id, due_at) の範囲検索1回で取れる
+        db.Index("ix_review_schedules_user_id_due_at", "user_id", "due_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey("questions.id"), nullable=False, index=True)
+    due_at = db.Column(db.DateTime, nullable=False)
+    interval_days = db.Column(db.Float, nullable=False, default=0.0)
+    ease = db.Column(db.Float, nullable=False, default=2.5)
+    streak = db.Column(db.Integer, nullable=False, default=0)   # 連続正解数
+    lapses = db.Column(db.Integer, nullable=False, default=0)   # 不正解になった回数
+    last_reviewed_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship("User", back_populates="review_schedules")
+    question = db.relationship("Question", back_populates="review_schedules")
+
+    def __repr__(self):
+        return f"<ReviewSchedule user_id={self.user_id} q_id={self.question_id} due_at={self.due_at}>"
+
+
+class ReviewSeed(db.Model):
+    """過去の解答履歴から復習スケジュールを作成済みのユーザー（スケジュールの有無とは別に記録する）"""
+    __tablename__ = "review_seeds"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    seeded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class DailyScore(db.Model):
+    """ランキング集計用の日別スコア（ユーザー × 範囲 × 日）。集計期間を過ぎた日は削除する"""
+    __tablename__ = "daily_scores"
+    __table_args__ = (
+        db.UniqueConstraint("scope", "user_id", "day", name="uq_daily_scores_scope_user_day"),
+        db.Index("ix_daily_scores_day", "day"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(50), nullable=False)  # "all" または章カテゴリ
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LeaderboardScore(db.Model):
+    """直近の集計期間内のスコア（ユーザー × 範囲）。解答のたびに加算し、順位はインデックスで引く"""
+    __tablename__ = "leaderboard_scores"
+    __table_args__ = (
+        db.UniqueConstraint("scope", "user_id", name="uq_leaderboard_scores_scope_user"),
+        db.Index("ix_leaderboard_scores_accuracy", "scope", "accuracy_bp", "answered"),
+        db.Index("ix_leaderboard_scores_answered", "scope", "answered"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    accuracy_bp = db.Column(db.Integer, nullable=False, default=0)  # 正解率（0.01% 単位の整数）
+
+
+class ExamTiming(db.Model):
+    """
+    時間制限ありの試験1回分の解答時間。問題ごとの (問題ID, 選んだ選択肢, 経過時間) を
+    固定長の整数に詰めた1つの BLOB として持ち、test_results の行は増やさない（形式は exam_timing.py）
+    """
+    __tablename__ = "exam_timings"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    mode = db.Column(db.SmallInteger, nullable=False)  # 1: 章末テスト, 2: 模擬試験
+    started_at = db.Column(db.DateTime, nullable=False)
+    submitted_at = db.Column(db.DateTime, nullable=False)
+    question_count = db.Column(db.SmallInteger, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
@@ -0,0 +1,95 @@
+import hashlib
+
+from sqlalchemy import case, func
+
+from database import db
+from model import Question, TestResult
+
+
+def series_etag(user_id, since=None, questions_version=0):
+    """
+    ユーザーの回答件数と最新IDから ETag を作る（全件集計より軽い）。
+    問題の章が変わるとカテゴリ別の内訳も変わるので、"questions" のバージョンも含める。
+    """
+    count, max_id = db.session.query(
+        func.count(TestResult.id), func.max(TestResult.id)
+    ).filter(TestResult.user_id == user_id).one()
+    raw = f"{user_id}:{count}:{max_id}:{since or ''}:{questions_version}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _accuracy(correct, answered):
+    return round((correct / answered) * 100, 2) if answered else 0
+
+
+def _empty_series():
+    return {"dates": [], "cumulative_questions": [], "accuracy_rates": []}
+
+
+def performance_series(user_id, since=None, questions_version=0):
+    """
+    日別の累計解答数・累計正解率を SQL で集計して返す。
+    since (YYYY-MM-DD) を指定するとその日以降の点だけを返し、
+    それより前の累計は baseline として含める（クライアント側の差分結合用）。
+    questions_version はそのまま返す（クライアントは保存済みの値と違えば全件を取り直す）。
+    """
+    day = func.date(TestResult.timestamp)
+    correct = func.sum(case((TestResult.user_answer_is_correct, 1), else_=0))
+    base_query = db.session.query(
+        Question.category, func.count(TestResult.id), correct
+    ).select_from(TestResult).outerjoin(Question, TestResult.question_id == Question.id).filter(
+        TestResult.user_id == user_id
+    )
+
+    # since より前の累計（全体とカテゴリ別）
+    totals = {"answered": 0, "correct": 0}
+    category_totals = {}
+    if since:
+        for category, answered, correct_count in base_query.filter(day < since).group_by(Question.category):
+            category = category or "none"
+            category_totals[category] = {"answered": answered, "correct": correct_count or 0}
+            totals["answered"] += answered
+            totals["correct"] += correct_count or 0
+
+    baseline = {
+        "cumulative_questions": totals["answered"],
+        "accuracy_rate": _accuracy(totals["correct"], totals["answered"]),
+    }
+
+    daily_query = db.session.query(
+        day, Question.category, func.count(TestResult.id), correct
+    ).select_from(TestResult).outerjoin(Question, TestResult.question_id == Question.id).filter(
+        TestResult.user_id == user_id
+    )
+    if since:
+        daily_query = daily_query.filter(day >= since)
+    rows = daily_query.group_by(day, Question.category).order_by(day).all()
+
+    overall = _empty_series()
+    categories = {}
+    current_date = None
+    for date_str, category, answered, correct_count in rows:
+        category = category or "none"
+        correct_count = correct_count or 0
+
+        # 全体: 日付が変わったら新しい点を追加、同じ日なら最後の点を更新
+        totals["answered"] += answered
+        totals["correct"] += correct_count
+        if date_str != current_date:
+            current_date = date_str
+            overall["dates"].append(date_str)
+            overall["cumulative_questions"].append(0)
+            overall["accuracy_rates"].append(0)
+        overall["cumulative_questions"][-1] = totals["answered"]
+        overall["accuracy_rates"][-1] = _accuracy(totals["correct"], totals["answered"])
+
+        # カテゴリ別
+        cat_totals = category_totals.setdefault(category, {"answered": 0, "correct": 0})
+        cat_totals["answered"] += answered
+        cat_totals["correct"] += correct_count
+        series = categories.setdefault(category, _empty_series())
+        series["dates"].append(date_str)
+        series["cumulative_questions"].append(cat_totals["answered"])
+        series["accuracy_rates"].append(_accuracy(cat_totals["correct"], cat_totals["answered"]))
+
+    return dict(overall, since=since, baseline=baseline, categories=categories, questions_version=questions_version)
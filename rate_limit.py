@@ -0,0 +1,210 @@
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, render_template, request, session
+from werkzeug.local import LocalProxy
+
+from cache_backend import MemoryCache
+
+# ルートのグループごとの既定値
+# 1人あたり・1IPあたりのトークンバケット（毎秒 rate 個、最大 burst 個）。
+# 教室など同じ IP から大勢が使うので IP 単位は大きめにしてある
+DEFAULT_RATE_LIMITS = {
+    "login": {"user": (5 / 60, 5), "ip": (5.0, 300)},
+    "exam_submit": {"user": (1 / 5, 5), "ip": (20.0, 600)},
+}
+# 同時に処理する数・処理待ちにできる数・待つ最大秒数（プロセスごと）。
+# 待っているリクエストもサーバーのスレッドを1つ占有するので、待ち行列は小さく、待ち時間は短くしておく
+DEFAULT_CONCURRENCY_LIMITS = {
+    "login": {"limit": 2, "queue": 4, "timeout": 2.0},
+    "exam_submit": {"limit": 4, "queue": 8, "timeout": 2.0},
+}
+
+METRIC_NAMES = ("admitted", "queued", "shed_user", "shed_ip", "shed_concurrency")
+
+
+class AdmissionGate:
+    """
+    同時実行数の上限。空きがなければ最大 queue 件まで timeout 秒待たせ、
+    待ち行列も一杯なら待たせずにすぐ断る。
+    waiting_slots は全グループで共有する待ち枠（サーバーのスレッドを待ちで使い切らないための上限）。
+    """
+
+    def __init__(self, limit, queue, timeout, waiting_slots=None):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._waiting_slots = waiting_slots
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def acquire(self):
+        """(入れたか, 待った秒数) を返す"""
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self.in_flight += 1
+            return True, 0.0
+        with self._lock:
+            if self.waiting >= self.queue:
+                return False, 0.0
+            if self._waiting_slots is not None and not self._waiting_slots.acquire(blocking=False):
+                return False, 0.0
+            self.waiting += 1
+        started = time.monotonic()
+        try:
+            admitted = self._slots.acquire(timeout=self.timeout)
+        finally:
+            if self._waiting_slots is not None:
+                self._waiting_slots.release()
+        with self._lock:
+            self.waiting -= 1
+            if admitted:
+                self.in_flight += 1
+        return admitted, time.monotonic() - started
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+class RateLimiter:
+    """
+    重いルート（ログインのパスワード検証・試験の回答送信）の流量制限。
+
+    1. ユーザー単位と IP 単位のトークンバケットで、1人（1か所）からの連打・再送を 429 で断る。
+       状態は既定でプロセス内に持ち、RATE_LIMIT_STORAGE = "shared" なら shared_cache のバックエンドに置いて
+       全ノードで共有する。
+    2. グループごとの同時実行数の上限（プロセス単位）。空きを待つ行列が一杯なら、待たせずに 429 を返す。
+       待っているリクエストはサーバーのスレッドを占有するので、全グループの待ちの合計は
+       スレッド数 (RATE_LIMIT_THREADS) − 同時実行数の合計 − 他のルート用に残す数 (RATE_LIMIT_RESERVED_THREADS)
+       までに抑える。
+
+    グループごとの受付・待ち・拒否の件数は stats() で参照できる。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.storage = None
+        self._gates = {}
+        self.waiting_limit = 0
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._max_wait = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATE_LIMIT_ENABLED", True)
+        app.config.setdefault("RATE_LIMIT_STORAGE", "memory")  # "shared" で全ノード共通のバケットにする
+        app.config.setdefault("RATE_LIMIT_MAX_KEYS", 100000)   # プロセス内に保持するバケット数の上限
+        app.config.setdefault("RATE_LIMITS", DEFAULT_RATE_LIMITS)
+        app.config.setdefault("CONCURRENCY_LIMITS", DEFAULT_CONCURRENCY_LIMITS)
+        app.config.setdefault("RATE_LIMIT_THREADS", app.config.get("DB_THREAD_POOL_SIZE", 16))
+        app.config.setdefault("RATE_LIMIT_RESERVED_THREADS", app.config["RATE_LIMIT_THREADS"] // 4)
+
+        if app.config["RATE_LIMIT_STORAGE"] == "shared":
+            self.storage = app.extensions["shared_cache"].backend
+        else:
+            self.storage = MemoryCache(max_entries=app.config["RATE_LIMIT_MAX_KEYS"])
+        concurrency = app.config["CONCURRENCY_LIMITS"]
+        self.waiting_limit = max(0, app.config["RATE_LIMIT_THREADS"] - app.config["RATE_LIMIT_RESERVED_THREADS"]
+                                 - sum(settings["limit"] for settings in concurrency.values()))
+        waiting_slots = threading.BoundedSemaphore(self.waiting_limit)
+        self._gates = {
+            group: AdmissionGate(**settings, waiting_slots=waiting_slots) for group, settings in concurrency.items()
+        }
+        groups = set(app.config["RATE_LIMITS"]) | set(self._gates)
+        self._metrics = {group: dict.fromkeys(METRIC_NAMES, 0) for group in groups}
+        self._max_wait = dict.fromkeys(groups, 0.0)
+        app.extensions["rate_limiter"] = self
+        self.app = app
+
+    def _count(self, group, name, waited=None):
+        with self._lock:
+            self._metrics[group][name] += 1
+            if waited:
+                self._metrics[group]["queued"] += 1
+                self._max_wait[group] = max(self._max_wait[group], waited)
+
+    def _check_buckets(self, group, user_key):
+        """トークンが取れなければ (拒否の種類, 待つべき秒数) を返す"""
+        limits = self.app.config["RATE_LIMITS"].get(group, {})
+        keys = (("user", user_key), ("ip", request.remote_addr or "-"))
+        for kind, key in keys:
+            if kind not in limits or not key:
+                continue
+            rate, burst = limits[kind]
+            allowed, retry_after = self.storage.take_token(f"ratelimit:{group}:{kind}:{key}", rate, burst)
+            if not allowed:
+                return f"shed_{kind}", retry_after
+        return None, 0.0
+
+    def call(self, group, user_key, methods, f, *args, **kwargs):
+        """制限を確認してから f を呼ぶ（rate_limited() デコレーターから使う）"""
+        if not self.app.config["RATE_LIMIT_ENABLED"] or request.method not in methods:
+            return f(*args, **kwargs)
+
+        key = user_key() if user_key else session.get("user")
+        shed, retry_after = self._check_buckets(group, key)
+        if shed:
+            self._count(group, shed)
+            return too_many_requests(retry_after)
+
+        gate = self._gates.get(group)
+        if gate is None:
+            self._count(group, "admitted")
+            return f(*args, **kwargs)
+        admitted, waited = gate.acquire()
+        if not admitted:
+            self._count(group, "shed_concurrency", waited)
+            return too_many_requests(1)
+        self._count(group, "admitted", waited)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            gate.release()
+
+    def stats(self):
+        with self._lock:
+            metrics = {group: dict(counts) for group, counts in self._metrics.items()}
+            max_wait = dict(self._max_wait)
+        for group, counts in metrics.items():
+            gate = self._gates.get(group)
+            counts["max_wait_ms"] = round(max_wait[group] * 1000, 1)
+            if gate is not None:
+                counts.update(in_flight=gate.in_flight, waiting=gate.waiting,
+                              concurrency_limit=gate.limit, queue_limit=gate.queue)
+        return {
+            "enabled": self.app.config["RATE_LIMIT_ENABLED"],
+            "storage": self.app.config["RATE_LIMIT_STORAGE"],
+            "waiting_limit": self.waiting_limit,
+            "groups": metrics,
+        }
+
+
+def rate_limited(group, user_key=None, methods=("POST",)):
+    """
+    ルートに流量制限をかけるデコレーター。制限の状態は処理中のアプリの RateLimiter が持つ。
+    user_key はユーザー単位のキーを返す関数（省略時はログイン中のメールアドレス）。
+    methods 以外のリクエストは素通しする。
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            return current_app.extensions["rate_limiter"].call(group, user_key, methods, f, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def too_many_requests(retry_after):
+    response = make_response(render_template("too_many_requests.html"), 429)
+    response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["rate_limiter"]）を、処理中のアプリから引く
+rate_limiter = LocalProxy(lambda: current_app.extensions["rate_limiter"])
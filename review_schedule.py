@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import db
+from model import ReviewSchedule, ReviewSeed, TestResult, User
+
+# SM-2 を正誤の2段階に簡略化したパラメータ
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+MAX_EASE = 3.0
+FIRST_INTERVAL_DAYS = 1
+SECOND_INTERVAL_DAYS = 6
+# 正解が続いても間隔が際限なく伸びない（日時の範囲を超えない）よう上限を設ける
+MAX_INTERVAL_DAYS = 365
+
+
+def new_schedule(user_id, question_id, now):
+    return ReviewSchedule(
+        user_id=user_id,
+        question_id=question_id,
+        due_at=now,
+        interval_days=0.0,
+        ease=INITIAL_EASE,
+        streak=0,
+        lapses=0
+    )
+
+
+def apply_review(schedule, is_correct, reviewed_at):
+    """1回分の解答結果でスケジュールを更新する。不正解なら即時に再出題対象へ戻す"""
+    if is_correct:
+        schedule.streak += 1
+        if schedule.streak == 1:
+            interval = FIRST_INTERVAL_DAYS
+        elif schedule.streak == 2:
+            interval = SECOND_INTERVAL_DAYS
+        else:
+            interval = min(MAX_INTERVAL_DAYS, schedule.interval_days * schedule.ease)
+        schedule.ease = min(MAX_EASE, schedule.ease + 0.1)
+    else:
+        schedule.streak = 0
+        schedule.lapses += 1
+        interval = 0.0
+        schedule.ease = max(MIN_EASE, schedule.ease - 0.2)
+
+    schedule.interval_days = interval
+    schedule.due_at = reviewed_at + timedelta(days=interval)
+    schedule.last_reviewed_at = reviewed_at
+
+
+def record_reviews(user_id, question_ids, is_correct, reviewed_at=None):
+    """採点結果をスケジュールに反映する（コミットは呼び出し側）"""
+    if not question_ids:
+        return
+    reviewed_at = reviewed_at or datetime.utcnow()
+    existing = {
+        s.question_id: s
+        for s in ReviewSchedule.query.filter(
+            ReviewSchedule.user_id == user_id, ReviewSchedule.question_id.in_(question_ids)
+        )
+    }
+    for q_id, ok in zip(question_ids, is_correct):
+        schedule = existing.get(q_id)
+        if schedule is None:
+            schedule = existing[q_id] = new_schedule(user_id, q_id, reviewed_at)
+            db.session.add(schedule)
+        apply_review(schedule, ok, reviewed_at)
+
+
+def due_question_ids(user_id, limit, now=None):
+    """出題日時を過ぎた問題を期限の古い順に最大 limit 件返す"""
+    now = now or datetime.utcnow()
+    rows = db.session.query(ReviewSchedule.question_id).filter(
+        ReviewSchedule.user_id == user_id, ReviewSchedule.due_at <= now
+    ).order_by(ReviewSchedule.due_at).limit(max(0, limit)).all()
+    return [row[0] for row in rows]
+
+
+def is_seeded(user_id):
+    return db.session.get(ReviewSeed, user_id) is not None
+
+
+def ensure_seeded(user_id):
+    """
+    まだなら過去の解答履歴からこのユーザーのスケジュールを作ってコミットする（ユーザーごとに一度だけ）。
+    今回の解答を test_results に INSERT する前に呼ぶこと（後だと今回の解答が二重に反映される）。
+    """
+    if is_seeded(user_id):
+        return
+    # 読み取りのスナップショットを持ったまま書き込むと、同時に作成したリクエストと衝突して失敗する。
+    # 新しいトランザクションの最初の書き込みで review_seeds の行を確保し、作成は1つのリクエストだけが行う
+    db.session.rollback()
+    claimed = db.session.execute(
+        sqlite_insert(ReviewSeed).values(user_id=user_id, seeded_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[ReviewSeed.user_id])
+    ).rowcount
+    if claimed:
+        seed_schedules(db.session, user_id)
+    db.session.commit()
+
+
+def seed_schedules(session, user_id=None, batch_size=1000):
+    """
+    既存の test_results の履歴を古い順に再生してスケジュールを作る。
+    user_id を省略すると全ユーザーが対象。作成済みの (ユーザー, 問題) は飛ばす。
+    対象ユーザーは作成済みとして review_seeds に記録する。作成した件数を返す。
+    """
+    existing_query = session.query(ReviewSchedule.user_id, ReviewSchedule.question_id)
+    history = session.query(
+        TestResult.user_id, TestResult.question_id, TestResult.user_answer_is_correct, TestResult.timestamp
+    ).order_by(TestResult.user_id, TestResult.question_id, TestResult.timestamp)
+    if user_id is not None:
+        existing_query = existing_query.filter(ReviewSchedule.user_id == user_id)
+        history = history.filter(TestResult.user_id == user_id)
+    existing = set(existing_query.all())
+
+    created = 0
+    pending = []
+    for (u_id, q_id), rows in groupby(history.yield_per(batch_size), key=lambda r: (r[0], r[1])):
+        if (u_id, q_id) in existing:
+            continue
+        rows = list(rows)
+        schedule = new_schedule(u_id, q_id, rows[0][3])
+        for _, _, is_correct, timestamp in rows:
+            apply_review(schedule, is_correct, timestamp)
+        pending.append(schedule)
+        if len(pending) >= batch_size:
+            session.add_all(pending)
+            session.flush()
+            created += len(pending)
+            pending = []
+
+    session.add_all(pending)
+    created += len(pending)
+
+    seeded = session.query(ReviewSeed.user_id)
+    users = session.query(User.id)
+    if user_id is not None:
+        seeded = seeded.filter(ReviewSeed.user_id == user_id)
+        users = users.filter(User.id == user_id)
+    seeded = {row[0] for row in seeded}
+    session.add_all(ReviewSeed(user_id=row[0]) for row in users if row[0] not in seeded)
+    return created
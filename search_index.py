@@ -0,0 +1,121 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "questions_fts"
+INDEXED_COLUMNS = ("question", "choice1", "choice2", "choice3", "choice4", "explanation")
+# bm25 の列ごとの重み（問題文 > 選択肢 > 解説）
+COLUMN_WEIGHTS = (10.0, 2.0, 2.0, 2.0, 2.0, 1.0)
+# trigram トークナイザは3文字未満の語を索引で引けない
+MIN_TRIGRAM_LENGTH = 3
+
+_columns = ", ".join(INDEXED_COLUMNS)
+_new_values = ", ".join(f"new.{c}" for c in INDEXED_COLUMNS)
+_old_values = ", ".join(f"old.{c}" for c in INDEXED_COLUMNS)
+
+_CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+    {_columns}, content='questions', content_rowid='id', tokenize='trigram'
+)
+"""
+
+# 管理画面・インポートスクリプトなど、どこから questions を更新しても索引が追従するようにトリガーで同期する
+_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON questions BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON questions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON questions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END
+    """,
+)
+
+
+def search_index_available(connection):
+    if connection.dialect.name != "sqlite":
+        return False
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+def ensure_search_index(engine):
+    """
+    全文検索用の FTS5 テーブルと同期トリガーを作成する。新規作成時は既存の問題から索引を構築する。
+    SQLite 以外、または trigram トークナイザが使えない SQLite では何もしない（検索は LIKE になる）。
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.begin() as connection:
+        if not search_index_available(connection):
+            try:
+                connection.execute(text(_CREATE_TABLE))
+            except OperationalError:
+                return False  # FTS5 / trigram 非対応 (SQLite 3.34 未満)
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        for trigger in _TRIGGERS:
+            connection.execute(text(trigger))
+    return True
+
+
+def rebuild_search_index(engine):
+    with engine.begin() as connection:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def _phrase(term):
+    # FTS5 のフレーズとしてクォートする（演算子や記号をそのまま検索できるように）
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_question_ids(session, query, category=None, limit=100):
+    """
+    問題文・選択肢・解説を対象に検索し、関連度順の問題IDを返す。
+    空白区切りの語はすべて含むもの (AND) を返す。
+    3文字以上の語は FTS5 (trigram) の索引で引き、短い語は LIKE で絞り込む。
+    """
+    terms = query.split()
+    if not terms:
+        return []
+
+    connection = session.connection()
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+    short_terms = [t for t in terms if len(t) < MIN_TRIGRAM_LENGTH]
+    params = {"limit": limit}
+
+    if long_terms and search_index_available(connection):
+        params["match"] = " AND ".join(_phrase(t) for t in long_terms)
+        weights = ", ".join(str(w) for w in COLUMN_WEIGHTS)
+        sql = (
+            f"SELECT q.id FROM {FTS_TABLE} JOIN questions q ON q.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match"
+        )
+        order_by = f" ORDER BY bm25({FTS_TABLE}, {weights})"
+        like_terms = short_terms
+    else:
+        # 索引が使えない場合は全件走査の LIKE 検索
+        sql = "SELECT q.id FROM questions q WHERE 1 = 1"
+        order_by = " ORDER BY q.id"
+        like_terms = terms
+
+    for i, term in enumerate(like_terms):
+        params[f"like{i}"] = _like(term)
+        sql += " AND (" + " OR ".join(f"q.{c} LIKE :like{i} ESCAPE '\\'" for c in INDEXED_COLUMNS) + ")"
+    if category:
+        params["category"] = category
+        sql += " AND q.category = :category"
+
+    rows = connection.execute(text(sql + order_by + " LIMIT :limit"), params)
+    return [row[0] for row in rows]
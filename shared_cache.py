@@ -0,0 +1,183 @@
+import os
+import secrets
+import threading
+import time
+
+from flask import current_app
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from werkzeug.local import LocalProxy
+
+from cache_backend import create_cache
+
+
+class SharedCache:
+    """
+    複数ノードで共有するキャッシュと、バージョンキーによる無効化。
+
+    各ノードのプロセス内キャッシュ（出題プール・選択肢 HTML・正解キー）は、
+    名前空間ごとのバージョン番号を共有バックエンドに置き、管理画面での更新時に番号を上げる。
+    各ノードはリクエスト処理前に最大 CACHE_VERSION_CHECK_SECONDS ごとに番号を確認し、
+    変わっていれば登録済みのコールバックでローカルのキャッシュを捨てる。
+    したがって他ノードでの編集はこの秒数以内に反映される。
+    期限切れの値（セッション・レート制限のバケットなど）も CACHE_PURGE_SECONDS ごとに同じ確認のついでに削除する。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self._lock = threading.Lock()
+        self._callbacks = {}  # namespace -> [callback, ...]
+        self._seen = {}       # namespace -> このノードが反映済みのバージョン
+        self._last_check = 0.0
+        self._last_purge = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_URL", "memory://")
+        app.config.setdefault("CACHE_VERSION_CHECK_SECONDS", 2.0)
+        app.config.setdefault("CACHE_PURGE_SECONDS", 300.0)
+        app.config.setdefault("SESSION_BACKEND", "cookie")  # "server" でセッションを共有キャッシュに保存
+        self.backend = create_cache(app.config["CACHE_URL"])
+        if app.config["CACHE_URL"].startswith("memory://") and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+            # バージョン番号がプロセスごとに別になり、他プロセスでの問題の更新はキャッシュの有効期限まで反映されない
+            app.logger.warning(
+                "CACHE_URL=memory:// with WEB_CONCURRENCY=%s: question edits reach other workers only "
+                "after the per-process cache TTLs; set CACHE_URL to sqlite:///... or redis://...",
+                os.environ["WEB_CONCURRENCY"],
+            )
+        app.before_request(self.sync)
+        if app.config["SESSION_BACKEND"] == "server":
+            app.session_interface = CacheSessionInterface(self.backend)
+        app.extensions["shared_cache"] = self
+        self.app = app
+
+    # --- バージョンキー ---
+    @staticmethod
+    def _version_key(namespace):
+        return f"version:{namespace}"
+
+    def version(self, namespace):
+        return self.backend.get(self._version_key(namespace)) or 0
+
+    def versioned_key(self, namespace, key):
+        """名前空間のバージョンを含むキー。バージョンが上がると古い値は参照されなくなる"""
+        return f"{namespace}:{self.version(namespace)}:{key}"
+
+    def subscribe(self, namespace, callback):
+        """namespace のバージョンが他ノードで上がったときに呼ぶ関数を登録する"""
+        with self._lock:
+            callbacks = self._callbacks.setdefault(namespace, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+            self._seen.setdefault(namespace, self.version(namespace))
+
+    def bump(self, namespace):
+        """このノードでの更新を他ノードへ知らせる（このノードのキャッシュは呼び出し側で更新済み）"""
+        new_version = self.backend.incr(self._version_key(namespace))
+        with self._lock:
+            missed = new_version != self._seen.get(namespace, 0) + 1
+            self._seen[namespace] = new_version
+        if missed:
+            # 確認の間に他ノードでも更新されていた
+            self._fire(namespace)
+        return new_version
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_check < self.app.config["CACHE_VERSION_CHECK_SECONDS"]:
+                return
+            self._last_check = now
+            namespaces = list(self._callbacks)
+            purge = now - self._last_purge >= self.app.config["CACHE_PURGE_SECONDS"]
+            if purge:
+                self._last_purge = now
+        if purge:
+            self.backend.purge_expired()
+        if not namespaces:
+            return
+
+        versions = self.backend.get_many([self._version_key(ns) for ns in namespaces])
+        for namespace in namespaces:
+            current = versions.get(self._version_key(namespace)) or 0
+            with self._lock:
+                changed = current != self._seen.get(namespace)
+                self._seen[namespace] = current
+            if changed:
+                self._fire(namespace)
+
+    def _fire(self, namespace):
+        for callback in self._callbacks.get(namespace, ()):
+            callback()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.opened_user = self.get("user")  # 読み込んだ時点のログインユーザー（ID を振り直すかの判定用）
+
+
+class CacheSessionInterface(SessionInterface):
+    """
+    セッションの中身を共有キャッシュに置き、Cookie にはランダムなセッションIDだけを入れる。
+    どのノードにリクエストが来ても同じ出題状態を参照できる。
+    ログインユーザーが変わったら（ログイン時）セッションIDを振り直し、
+    ログイン前に知られた ID をそのまま使わせない（セッション固定攻撃の対策）。
+    """
+
+    key_prefix = "session:"
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _new_sid(self):
+        return secrets.token_urlsafe(32)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.backend.get(self.key_prefix + sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=self._new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.backend.delete(self.key_prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.get("user") != session.opened_user and not session.new:
+            self.backend.delete(self.key_prefix + session.sid)
+            session.sid = self._new_sid()
+        elif not self.should_set_cookie(app, session):
+            return
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        self.backend.set(self.key_prefix + session.sid, dict(session), ttl=ttl)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+# create_app() がアプリごとに作るインスタンス（app.extensions["shared_cache"]）を、処理中のアプリから引く
+shared_cache = LocalProxy(lambda: current_app.extensions["shared_cache"])
@@ -0,0 +1,13 @@
+"""
+本番用の WSGI エントリポイント（開発時は python app.py）
+
+    waitress-serve --threads=16 wsgi:app
+    CACHE_URL=sqlite:///instance/cache.db WEB_CONCURRENCY=2 gunicorn --threads 16 wsgi:app
+
+スレッド数は DB_THREAD_POOL_SIZE（DB 接続プールの大きさ）と揃える。
+複数プロセスで動かすときは CACHE_URL に共有バックエンドを指定する（memory:// のままだと、
+問題の編集が他プロセスのキャッシュに反映されるのは各キャッシュの有効期限後になる）。
+"""
+from app import create_app
+
+app = create_app()